@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+静态资源指纹和预压缩
+
+构建（部署前执行一次）：
+
+    $ python -m app.assets
+
+把 static/ 下的文件复制到 static/dist/，文件名加上内容的哈希（jquery.min.js -> jquery.min.3f2a1b9c0d.js），
+CSS 中引用的字体、图片改为加了哈希的文件名；可压缩的文件同时生成 .gz 和 .br（需要 pip install brotli），
+原文件名到新文件名的对应关系写入 static/dist/manifest.json
+
+运行时模板中的 url_for('static', path=...) 查 manifest 返回加了哈希的地址，
+AssetFiles 按 Accept-Encoding 返回预压缩的文件，并且可以永久缓存（内容变化时文件名也会变化）；
+没有构建时和原来一样直接使用 static/ 下的文件
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+from typing import Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# 可以压缩的类型，字体中 woff/woff2 本身已经压缩
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map', '.ttf', '.eot', '.otf'}
+# 太小的文件压缩后节省不了多少
+MIN_COMPRESS_SIZE = 1024
+
+# 按优先级
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    """Accept-Encoding 中可以接受的编码（q=0 表示不接受）"""
+    accepted = set()
+    for item in accept_encoding.split(','):
+        encoding, *params = [part.strip() for part in item.split(';')]
+        if encoding and not any(param.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000') for param in params):
+            accepted.add(encoding.lower())
+    return accepted
+
+
+def fingerprint(name: str, content: bytes) -> str:
+    """js/jquery.min.js -> js/jquery.min.<hash>.js"""
+    digest = hashlib.md5(content).hexdigest()[:10]
+    root, ext = posixpath.splitext(name)
+    return f'{root}.{digest}{ext}'
+
+
+def rewrite_css(name: str, content: bytes, manifest: Dict[str, str]) -> bytes:
+    """CSS 中的相对地址改为加了哈希的文件，? 和 # 之后的部分保留"""
+    directory = posixpath.dirname(name)
+
+    def replace(match):
+        quote, url = match.groups()
+        if url.startswith(('data:', 'http:', 'https:', '//', '/')):
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        target = manifest.get(posixpath.normpath(posixpath.join(directory, path)))
+        if target is None:
+            return match.group(0)
+        return f'url({quote}{posixpath.relpath(target, directory)}{suffix}{quote})'
+
+    return _CSS_URL.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def _write(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def _compress(path: str, content: bytes) -> list:
+    encodings = []
+    if os.path.splitext(path)[1] not in COMPRESSIBLE or len(content) < MIN_COMPRESS_SIZE:
+        return encodings
+    variants = [('gzip', '.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('br', '.br', brotli.compress(content)))
+    for encoding, suffix, compressed in variants:
+        if len(compressed) < len(content):
+            _write(path + suffix, compressed)
+            encodings.append(encoding)
+    return encodings
+
+
+def build(directory: str = 'static') -> dict:
+    """返回 manifest：{"files": {原路径: 新路径}, "encodings": {新路径: [编码]}}，路径相对于 directory/dist"""
+    dist = os.path.join(directory, DIST)
+    shutil.rmtree(dist, ignore_errors=True)
+
+    names = []
+    for root, dirs, files in os.walk(directory):
+        if root == directory and DIST in dirs:
+            dirs.remove(DIST)
+        for filename in files:
+            names.append(os.path.relpath(os.path.join(root, filename), directory).replace(os.sep, '/'))
+    # CSS 最后处理，这时引用的文件都已经有了新文件名
+    names.sort(key=lambda name: (name.endswith('.css'), name))
+
+    files = {}
+    encodings = {}
+    for name in names:
+        with open(os.path.join(directory, name), 'rb') as f:
+            content = f.read()
+        if name.endswith('.css'):
+            content = rewrite_css(name, content, files)
+        files[name] = fingerprint(name, content)
+        path = os.path.join(dist, files[name])
+        _write(path, content)
+        encodings[files[name]] = _compress(path, content)
+
+    manifest = {'files': files, 'encodings': encodings}
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(directory: str = 'static') -> Optional[dict]:
+    """没有构建时返回 None"""
+    try:
+        with open(os.path.join(directory, DIST, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def asset_path(manifest: Optional[dict], path: str) -> str:
+    """url_for('static', path=...) 中的 path 换成加了哈希的文件"""
+    if manifest:
+        name = manifest['files'].get(path.lstrip('/'))
+        if name is not None:
+            return f'/{DIST}/{name}'
+    return path
+
+
+class AssetFiles(StaticFiles):
+    """
+    dist 下加了哈希的文件：按 Accept-Encoding 返回 .br / .gz，永久缓存
+    其他文件和 StaticFiles 相同
+    """
+
+    def __init__(self, *, directory: str, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.assets_directory = directory
+        self.manifest = load_manifest(directory)
+        # dist/<新路径> -> 可用的编码
+        self.assets = {
+            f'{DIST}/{name}': encodings for name, encodings in (self.manifest or {}).get('encodings', {}).items()
+        }
+
+    async def get_response(self, path: str, scope) -> Response:
+        path = path.replace(os.sep, '/')
+        encodings = self.assets.get(path)
+        if encodings is None:
+            return await super().get_response(path, scope)
+        if scope['method'] not in ('GET', 'HEAD'):
+            return Response('Method Not Allowed', status_code=405, media_type='text/plain')
+
+        accepted = accepted_encodings(Headers(scope=scope).get('accept-encoding', ''))
+        headers = {'Cache-Control': IMMUTABLE, 'Vary': 'Accept-Encoding'}
+        full_path = os.path.join(self.assets_directory, path)
+        for encoding, suffix in ENCODINGS:
+            if encoding in encodings and encoding in accepted:
+                full_path += suffix
+                headers['Content-Encoding'] = encoding
+                break
+
+        stat_result = await run_in_threadpool(os.stat, full_path)
+        media_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        return FileResponse(full_path, stat_result=stat_result, media_type=media_type, headers=headers)
+
+
+if __name__ == '__main__':
+    result = build()
+    compressed = sum(1 for encodings in result['encodings'].values() if encodings)
+    print(f'{len(result["files"])} files, {compressed} precompressed -> static/{DIST}/{MANIFEST}')
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+crud 的异步版本，使用 SQLAlchemy Core 查询，返回 Record
+"""
+from typing import List, Optional
+
+from sqlalchemy import select
+
+from . import crud
+from .async_database import AsyncDatabase, Record
+from .models import City, Data
+from .schemas import CreateCity, CreateData, ReadCity
+
+city_table = City.__table__
+data_table = Data.__table__
+
+# Data 关联 City 时，City 的列加上 city__ 前缀避免重名（Data 本身有 city_id 列）
+CITY_COLUMNS = [column.label(f'city__{column.key}') for column in city_table.c]
+
+
+async def get_city(database: AsyncDatabase, city_id: int) -> Optional[Record]:
+    return await database.fetch_one(select([city_table]).where(city_table.c.id == city_id))
+
+
+async def get_city_by_name(database: AsyncDatabase, city_name: str) -> Optional[Record]:
+    return await database.fetch_one(select([city_table]).where(city_table.c.province == city_name))
+
+
+async def get_city_info(database: AsyncDatabase, city_name: str) -> Optional[ReadCity]:
+    """和 crud.get_city_info 共用缓存"""
+    city = crud.city_cache.get(city_name)
+    if city is None:
+        record = await get_city_by_name(database, city_name)
+        if record is None:
+            return None
+        city = ReadCity.parse_obj(record)
+        crud.city_cache.set(city_name, city)
+    return city
+
+
+async def get_cities(database: AsyncDatabase, skip: int = 0, limit: int = 10, after: str = None) -> List[Record]:
+    query = select([city_table]).order_by(city_table.c.country_code, city_table.c.id)
+    if after:
+        query = query.where(crud.city_after_clause(after))
+    return await database.fetch_all(query.offset(skip).limit(limit))
+
+
+async def create_city(database: AsyncDatabase, city: CreateCity) -> Record:
+    city_id = await database.execute(city_table.insert().values(**city.dict()))
+    crud.city_cache.pop(city.province)
+    crud.mark_written()
+    return await get_city(database, city_id)
+
+
+def _with_city(row: Record) -> Record:
+    """拆出 city__ 前缀的列，组成和 ORM 一致的 row.city"""
+    city = Record()
+    for column in city_table.c:
+        city[column.key] = row.pop(f'city__{column.key}')
+    row['city'] = city if city['id'] is not None else None
+    return row
+
+
+async def get_data(database: AsyncDatabase, city: str = None, skip: int = 0, limit: int = 10,
+                   after: str = None) -> List[Record]:
+    if city:
+        query = select([data_table] + CITY_COLUMNS).select_from(data_table.join(city_table))
+        query = query.where(city_table.c.province == city)
+    else:
+        query = select([data_table] + CITY_COLUMNS).select_from(data_table.outerjoin(city_table))
+
+    query = query.order_by(data_table.c.date.desc(), data_table.c.id.desc())
+    if after:
+        query = query.where(crud.data_after_clause(after))
+
+    rows = await database.fetch_all(query.offset(skip).limit(limit))
+    return [_with_city(row) for row in rows]
+
+
+async def get_data_version(database: AsyncDatabase, city: str = None):
+    """同 crud.get_data_version"""
+    if city:
+        db_city = await get_city_info(database, city)
+        if db_city is None:
+            return f'none-{crud.write_state["generation"]}', crud.write_state['at']
+        row = await database.fetch_one(crud.data_version_query(db_city.id))
+    else:
+        row = await database.fetch_one(crud.data_version_query())
+    return crud.data_version(*row.values())
+
+
+async def create_city_data(database: AsyncDatabase, data: CreateData, city_id: int) -> Record:
+    data_id = await database.execute(data_table.insert().values(**data.dict(), city_id=city_id))
+    for row in crud.latest_rows([dict(data.dict(), city_id=city_id)]):
+        await database.execute(crud.upsert_latest.bindparams(**row))
+    crud.mark_written()
+    return await database.fetch_one(select([data_table]).where(data_table.c.id == data_id))
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+异步数据库访问
+
+SQLAlchemy 1.3 没有异步接口，这里用 SQLAlchemy Core 生成 SQL，交给 aiosqlite 执行
+需要安装 pip install aiosqlite
+
+aiosqlite 的每个连接在自己的后台线程中执行 SQL，不占用 Starlette 的线程池；
+连接常驻在连接池中，避免每个请求重新打开数据库
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+import aiosqlite
+from sqlalchemy.dialects.sqlite import pysqlite
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.sql import ClauseElement
+
+from .config import settings
+from . import sqlstats
+from .database import get_profile
+
+
+class Record(dict):
+    """查询结果，既可以 row['id'] 也可以 row.id，和 ORM 对象的用法一致"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class AsyncDatabase(object):
+
+    def __init__(self, url: str, pool_size: int = 4, pragmas: dict = None):
+        self.path = make_url(url).database
+        self.pool_size = pool_size
+        self.pragmas = pragmas or {}
+        self.dialect = pysqlite.dialect(paramstyle='qmark')
+        self._pool = None  # type: Optional[asyncio.Queue]
+        self._connections = []
+
+    async def connect(self):
+        if self._pool is not None:
+            return
+        self._pool = asyncio.Queue()
+        for _ in range(self.pool_size):
+            # isolation_level=None 自动提交
+            connection = await aiosqlite.connect(self.path, isolation_level=None)
+            # 和同步引擎使用相同的 pragma
+            for name, value in self.pragmas.items():
+                await connection.execute(f'PRAGMA {name} = {value}')
+            self._connections.append(connection)
+            self._pool.put_nowait(connection)
+
+    async def disconnect(self):
+        for connection in self._connections:
+            await connection.close()
+        self._connections = []
+        self._pool = None
+
+    @asynccontextmanager
+    async def connection(self):
+        assert self._pool is not None, 'database is not connected'
+        connection = await self._pool.get()
+        try:
+            yield connection
+        finally:
+            self._pool.put_nowait(connection)
+
+    def _compile(self, query: ClauseElement):
+        """编译为 qmark 风格的 SQL，参数和结果按列类型转换（如 Date 和字符串之间）"""
+        compiled = query.compile(dialect=self.dialect)
+        params = compiled.construct_params()
+        args = []
+        for name in compiled.positiontup:
+            value = params[name]
+            processor = compiled.binds[name].type._cached_bind_processor(self.dialect)
+            args.append(processor(value) if processor else value)
+
+        columns = [
+            (column.key, column.type._cached_result_processor(self.dialect, None))
+            for column in getattr(query, 'selected_columns', getattr(query, 'c', []))
+        ] if query.is_selectable else []
+        return compiled.string, args, columns
+
+    @staticmethod
+    def _record(columns, row) -> Record:
+        return Record(
+            (key, processor(value) if processor else value)
+            for (key, processor), value in zip(columns, row)
+        )
+
+    async def fetch_all(self, query: ClauseElement) -> List[Record]:
+        sql, args, columns = self._compile(query)
+        async with self.connection() as connection:
+            start = time.perf_counter()
+            async with connection.execute(sql, args) as cursor:
+                rows = await cursor.fetchall()
+            sqlstats.record(sql, time.perf_counter() - start)
+        return [self._record(columns, row) for row in rows]
+
+    async def fetch_one(self, query: ClauseElement) -> Optional[Record]:
+        sql, args, columns = self._compile(query)
+        async with self.connection() as connection:
+            start = time.perf_counter()
+            async with connection.execute(sql, args) as cursor:
+                row = await cursor.fetchone()
+            sqlstats.record(sql, time.perf_counter() - start)
+        return None if row is None else self._record(columns, row)
+
+    async def execute(self, query: ClauseElement) -> int:
+        """返回插入行的id"""
+        sql, args, _ = self._compile(query)
+        async with self.connection() as connection:
+            start = time.perf_counter()
+            async with connection.execute(sql, args) as cursor:
+                lastrowid = cursor.lastrowid
+            sqlstats.record(sql, time.perf_counter() - start)
+            return lastrowid
+
+
+database = AsyncDatabase(settings.database_url, pool_size=settings.async_pool_size,
+                         pragmas=get_profile()['pragmas'])
+
+
+async def get_async_db():
+    yield database
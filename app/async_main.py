@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+第七章路由的异步版本，设置 APP_ASYNC_DB=1 后由 run.py 替换 app.main.app07
+
+读写数据库的路由使用 async def + aiosqlite，在事件循环中运行，不再占用线程池；
+这里没有重写的路由沿用 app.main 中的同步版本
+"""
+from typing import List
+
+from fastapi import APIRouter, Request, Response, Depends, HTTPException, status
+
+from . import async_crud, columnar, conditional, crud, main
+from .async_database import AsyncDatabase, get_async_db
+from .schemas import CreateCity, CreateData, ReadCity, ReadData
+
+app07 = APIRouter()
+
+
+@app07.get('/')
+async def index(request: Request,
+                city: str = None,
+                skip: int = 0,
+                limit: int = 10,
+                after: str = None,
+                db: AsyncDatabase = Depends(get_async_db)):
+    version, last_modified = await async_crud.get_data_version(database=db, city=city)
+    headers = main.data_validators(request, version, last_modified)
+    if conditional.is_not_modified(request, headers['ETag'], last_modified):
+        return conditional.not_modified_response(headers)
+
+    try:
+        data = await async_crud.get_data(database=db, city=city, skip=skip, limit=limit, after=after)
+    except ValueError:
+        raise main.invalid_cursor()
+
+    return main.render_home(request, data, city, limit, headers)
+
+
+@app07.post('/createCity', response_model=ReadCity)
+async def create_city(city: CreateCity, db: AsyncDatabase = Depends(get_async_db)):
+    db_city = await async_crud.get_city_info(database=db, city_name=city.province)
+    if db_city:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='city is exists')
+
+    return await async_crud.create_city(database=db, city=city)
+
+
+@app07.get('/getCity/{city}', response_model=ReadCity)
+async def get_city(city: str, db: AsyncDatabase = Depends(get_async_db)):
+    db_city = await async_crud.get_city_info(database=db, city_name=city)
+    if db_city is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='city not found')
+    else:
+        return db_city
+
+
+@app07.post('/getCites', response_model=List[ReadCity])
+async def get_cites(response: Response, skip: int = 0, limit: int = 10, after: str = None,
+                    db: AsyncDatabase = Depends(get_async_db)):
+    try:
+        cities = await async_crud.get_cities(database=db, skip=skip, limit=limit, after=after)
+    except ValueError:
+        raise main.invalid_cursor()
+
+    cursor = crud.next_cursor(cities, limit, crud.city_cursor)
+    if cursor:
+        response.headers[main.NEXT_CURSOR_HEADER] = cursor
+    return cities
+
+
+@app07.post('/createData', response_model=ReadData)
+async def create_data(data: CreateData, city: str, db: AsyncDatabase = Depends(get_async_db)):
+    db_city = await async_crud.get_city_info(database=db, city_name=city)
+    if db_city is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='city not found')
+    return await async_crud.create_city_data(database=db, data=data, city_id=db_city.id)
+
+
+@app07.get('/get_data')
+async def get_data(request: Request,
+                   response: Response,
+                   city: str = None,
+                   skip: int = 0,
+                   limit: int = 10,
+                   after: str = None,
+                   db: AsyncDatabase = Depends(get_async_db)):
+    media_type = main.data_media_type(request)
+    version, last_modified = await async_crud.get_data_version(database=db, city=city)
+    headers = main.data_validators(request, version, last_modified, media_type)
+    if conditional.is_not_modified(request, headers['ETag'], last_modified):
+        return conditional.not_modified_response(headers)
+
+    try:
+        data = await async_crud.get_data(database=db, city=city, skip=skip, limit=limit, after=after)
+    except ValueError:
+        raise main.invalid_cursor()
+
+    cursor = crud.next_cursor(data, limit, crud.data_cursor)
+    if cursor:
+        headers[main.NEXT_CURSOR_HEADER] = cursor
+    if media_type != columnar.DEFAULT:
+        return main.columnar_response(data, media_type, headers)
+
+    response.headers.update(headers)
+    return data
+
+
+# 其余路由沿用同步版本
+_async_routes = {(route.path, method) for route in app07.routes for method in route.methods}
+for _route in main.app07.routes:
+    if not any((_route.path, method) in _async_routes for method in _route.methods):
+        app07.routes.append(_route)
+
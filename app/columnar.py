@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Data 的列式表示
+
+按行的 JSON 每一行都重复所有的键，列式表示每列一个数组：
+- 日期为距 bases.date 的天数，时间为距 bases.<列名> 的秒数
+- application/vnd.columnar+json：JSON，{"count", "bases", "cities", "columns": {列名: [值, ...]}}
+- application/vnd.columnar：二进制，4 字节小端的头部长度 + 头部 JSON + 各列数据，
+  头部的 columns 为 [{"name", "dtype"}]，各列按顺序紧密排列，整数按取值范围使用最小的类型
+
+需要安装 pip install numpy
+"""
+import json
+import struct
+from datetime import date, datetime, timedelta
+from typing import Optional, Sequence
+
+import numpy as np
+
+DEFAULT = 'application/json'
+COLUMNAR_JSON = 'application/vnd.columnar+json'
+COLUMNAR_BINARY = 'application/vnd.columnar'
+
+INTEGER_COLUMNS = ('id', 'city_id', 'confirmed', 'deaths', 'recovered')
+DATE_COLUMNS = ('date',)
+DATETIME_COLUMNS = ('created_at', 'updated_at')
+COLUMNS = INTEGER_COLUMNS + DATE_COLUMNS + DATETIME_COLUMNS
+
+_HEADER = struct.Struct('<I')
+_DTYPES = ('<i1', '<i2', '<i4', '<i8')
+# 数据库中的时间不带时区（UTC）
+_EPOCH = datetime(1970, 1, 1)
+
+
+def negotiate(accept: Optional[str], offers: Sequence[str]) -> str:
+    """按 Accept 的 q 值选择 offers 中的一个，没有匹配时返回第一个"""
+    best, best_q = offers[0], 0.0
+    for media_range in (accept or '').split(','):
+        media_type, *params = [part.strip() for part in media_range.split(';')]
+        q = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type in offers and q > best_q:
+            best, best_q = media_type, q
+    return best
+
+
+def _pack(values: np.ndarray) -> np.ndarray:
+    """整数使用能容纳全部取值的最小类型"""
+    for dtype in _DTYPES[:-1]:
+        info = np.iinfo(dtype)
+        if not values.size or (values.min() >= info.min and values.max() <= info.max):
+            return values.astype(dtype)
+    return values.astype(_DTYPES[-1])
+
+
+def to_columns(rows: list):
+    """rows 为 Data 或 Record，返回 (bases, cities, {列名: np.ndarray})"""
+    count = len(rows)
+    columns = {}
+    bases = {}
+    for name in INTEGER_COLUMNS:
+        columns[name] = np.fromiter((getattr(row, name) or 0 for row in rows), np.int64, count)
+    for name in DATE_COLUMNS:
+        ordinals = np.fromiter((getattr(row, name).toordinal() for row in rows), np.int64, count)
+        base = int(ordinals.min()) if count else 0
+        bases[name] = date.fromordinal(base).isoformat() if count else None
+        columns[name] = ordinals - base
+    for name in DATETIME_COLUMNS:
+        seconds = np.fromiter((_timestamp(getattr(row, name)) for row in rows), np.int64, count)
+        base = int(seconds.min()) if count else 0
+        bases[name] = (_EPOCH + timedelta(seconds=base)).isoformat() if count else None
+        columns[name] = seconds - base
+
+    cities = {}
+    for row in rows:
+        city = getattr(row, 'city', None)
+        if city is not None:
+            cities[city.id] = city.province
+    return bases, cities, columns
+
+
+def _timestamp(value: Optional[datetime]) -> int:
+    return int((value - _EPOCH).total_seconds()) if value else 0
+
+
+def encode_json(rows: list) -> bytes:
+    bases, cities, columns = to_columns(rows)
+    return json.dumps({
+        'count': len(rows),
+        'bases': bases,
+        'cities': cities,
+        'columns': {name: values.tolist() for name, values in columns.items()},
+    }, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def encode_binary(rows: list) -> bytes:
+    bases, cities, columns = to_columns(rows)
+    packed = {name: _pack(values) for name, values in columns.items()}
+    header = json.dumps({
+        'count': len(rows),
+        'bases': bases,
+        'cities': cities,
+        'columns': [{'name': name, 'dtype': values.dtype.str} for name, values in packed.items()],
+    }, separators=(',', ':'), ensure_ascii=False).encode()
+    return b''.join([_HEADER.pack(len(header)), header] + [values.tobytes() for values in packed.values()])
+
+
+def decode_binary(content: bytes) -> dict:
+    """encode_binary 的逆过程，返回头部，其中 columns 为 {列名: np.ndarray}（客户端示例和测试使用）"""
+    (length,) = _HEADER.unpack_from(content)
+    offset = _HEADER.size + length
+    header = json.loads(content[_HEADER.size:offset])
+    columns = {}
+    for column in header['columns']:
+        values = np.frombuffer(content, dtype=column['dtype'], count=header['count'], offset=offset)
+        offset += values.nbytes
+        columns[column['name']] = values
+    header['columns'] = columns
+    return header
+
+
+ENCODERS = {
+    COLUMNAR_JSON: encode_json,
+    COLUMNAR_BINARY: encode_binary,
+}
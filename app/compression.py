@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+响应压缩
+
+和 starlette 的 GZipMiddleware 相比：
+- 按 Accept-Encoding 选择 br（需要 pip install brotli）或 gzip
+- 已经压缩的类型（图片、字体、压缩包）和已有 Content-Encoding 的响应（如 assets 中预压缩的文件）不再压缩
+- 一次发送完的响应小于 settings.compression_minimum_size 时不压缩
+- StreamingResponse（导出、流式渲染的页面）每收到一块就压缩并 flush 一块，不缓存整个响应
+"""
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from .assets import accepted_encodings
+from .config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 这些类型本身已经压缩过
+EXCLUDED_TYPES = (
+    'image/', 'audio/', 'video/', 'font/woff', 'application/font-woff',
+    'application/zip', 'application/gzip', 'application/x-gzip', 'application/x-brotli',
+    'application/pdf', 'application/octet-stream',
+)
+# 例外：文本格式的图片
+INCLUDED_TYPES = ('image/svg+xml',)
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    if not content_type:
+        return False
+    content_type = content_type.lower()
+    return content_type.startswith(INCLUDED_TYPES) or not content_type.startswith(EXCLUDED_TYPES)
+
+
+class GzipCompressor(object):
+
+    def __init__(self, level: int):
+        # wbits=31 输出 gzip 格式（带头和校验）
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, more: bool) -> bytes:
+        """more 为 True 时 flush 已压缩的数据，客户端可以马上解压这一块"""
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH if more else zlib.Z_FINISH)
+
+
+class BrotliCompressor(object):
+
+    def __init__(self, quality: int):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, more: bool) -> bytes:
+        return self.compressor.process(data) + (self.compressor.flush() if more else self.compressor.finish())
+
+
+class CompressionMiddleware(object):
+    """纯 ASGI 中间件，HEAD 请求和状态码 204/304 的响应没有响应体，不处理"""
+
+    def __init__(self, app, minimum_size: int = None, gzip_level: int = None, brotli_quality: int = None):
+        self.app = app
+        self.minimum_size = settings.compression_minimum_size if minimum_size is None else minimum_size
+        self.gzip_level = settings.compression_gzip_level if gzip_level is None else gzip_level
+        self.brotli_quality = settings.compression_brotli_quality if brotli_quality is None else brotli_quality
+        # 按优先级
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def make_compressor(self, encoding: str):
+        if encoding == 'br':
+            return BrotliCompressor(self.brotli_quality)
+        return GzipCompressor(self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] == 'HEAD':
+            return await self.app(scope, receive, send)
+
+        accepted = accepted_encodings(Headers(scope=scope).get('accept-encoding', ''))
+        encoding = next((encoding for encoding in self.encodings if encoding in accepted), None)
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start_message = None
+        compressor = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor, passthrough
+            if message['type'] == 'http.response.start':
+                headers = Headers(raw=message['headers'])
+                if ('content-encoding' in headers
+                        or message['status'] in (204, 304)
+                        or 'no-transform' in headers.get('cache-control', '')
+                        or not is_compressible(headers.get('content-type'))):
+                    passthrough = True
+                    await send(message)
+                else:
+                    # 等到第一块响应体，才知道是否需要压缩
+                    start_message = message
+                return
+            if passthrough or message['type'] != 'http.response.body':
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            more = message.get('more_body', False)
+            if start_message is not None:
+                headers = MutableHeaders(scope=start_message)
+                headers.add_vary_header('Accept-Encoding')
+                if not more and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+                compressor = self.make_compressor(encoding)
+                body = compressor.compress(body, more)
+                headers['Content-Encoding'] = encoding
+                if more:
+                    # 流式响应，长度未知
+                    del headers['Content-Length']
+                else:
+                    headers['Content-Length'] = str(len(body))
+                await send(start_message)
+                start_message = None
+            else:
+                body = compressor.compress(body, more)
+            await send({'type': 'http.response.body', 'body': body, 'more_body': more})
+
+        await self.app(scope, receive, send_wrapper)
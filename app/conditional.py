@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+条件请求（ETag / Last-Modified / 304）
+
+客户端带上一次响应的 ETag（If-None-Match）或 Last-Modified（If-Modified-Since）再次请求，
+数据没有变化时直接返回 304，不查询 ORM、不序列化、不渲染模板
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional
+
+from fastapi import Request, Response, status
+
+
+def make_etag(*parts) -> str:
+    """弱校验的 ETag，表示内容语义相同"""
+    digest = hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def validators(etag: str, last_modified: Optional[datetime]) -> Dict[str, str]:
+    """需要放到响应中的头，last_modified 为 UTC 时间"""
+    headers = {
+        'ETag': etag,
+        # 允许缓存，但每次使用前都要向服务器验证
+        'Cache-Control': 'no-cache',
+    }
+    if last_modified:
+        headers['Last-Modified'] = format_datetime(last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+
+def _strip_weak(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    # 有 If-None-Match 时忽略 If-Modified-Since
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        return _strip_weak(etag) in {_strip_weak(tag) for tag in if_none_match.split(',')}
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+    return False
+
+
+def not_modified_response(headers: Dict[str, str]) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
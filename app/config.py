@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+项目配置
+
+基于 pydantic 的 BaseSettings，可以通过环境变量覆盖默认值，变量名加 APP_ 前缀
+如：APP_SYNC_CHUNK_SIZE=10000 uvicorn run:app
+"""
+from typing import Dict, Union
+
+from pydantic import BaseSettings
+
+
+class Settings(BaseSettings):
+    database_url: str = 'sqlite:///data.sqlite'
+    # 引擎配置 dev / prod，见 database.PROFILES
+    db_profile: str = 'dev'
+    # 覆盖 profile 中的 pragma，如 APP_DB_PRAGMAS='{"cache_size": -131072}'
+    db_pragmas: Dict[str, Union[int, str]] = {}
+    # prod 的连接池大小
+    db_pool_size: int = 8
+    db_max_overflow: int = 8
+    db_pool_timeout: float = 30
+    # 使用 aiosqlite 异步访问数据库，第七章的路由直接在事件循环中运行，不占用线程池
+    async_db: bool = False
+    # 异步连接池大小，每个 aiosqlite 连接有一个自己的后台线程
+    async_pool_size: int = 4
+
+    # SQL 统计：超过这个毫秒数的语句记录到慢查询日志；同一个请求中相同的语句执行这么多次视为 N+1
+    sql_slow_ms: float = 100
+    sql_n_plus_one: int = 5
+
+    # 模板字节码缓存目录，为空时使用系统临时目录；生产环境可以关闭 auto_reload，不再检查模板是否修改
+    template_cache_dir: str = ''
+    template_auto_reload: bool = True
+    # 流式渲染时每次发送的字符数
+    template_chunk_size: int = 8192
+
+    # 响应压缩：小于这个字节数的响应不压缩；动态内容使用较快的压缩级别
+    compression_minimum_size: int = 500
+    compression_gzip_level: int = 6
+    compression_brotli_quality: int = 4
+
+    # 城市名 -> 城市的缓存，City 表很小且几乎只读
+    city_cache: bool = True
+    city_cache_size: int = 1024
+    # 过期秒数，其他进程修改城市后最多在这段时间后生效
+    city_cache_ttl: float = 600
+
+    # 同步数据源文件，格式同 app/data.json
+    sync_data_file: str = 'app/data.json'
+    # 批量写入时每个事务包含的行数
+    sync_chunk_size: int = 5000
+
+    # NDJSON 批量写入：每批（一个事务）的行数和单行的最大字节数
+    ingest_batch_size: int = 1000
+    ingest_max_line: int = 64 * 1024
+    # 导出时每次从游标读取的行数
+    export_chunk_size: int = 1000
+
+    class Config:
+        env_prefix = 'APP_'
+
+
+settings = Settings()
@@ -1,8 +1,30 @@
 # -*- coding: utf-8 -*-
-from sqlalchemy.orm import Session
+import base64
+import json
+from datetime import date, datetime
+from itertools import count, islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-from .models import City, Data
-from .schemas import CreateCity, CreateData
+from sqlalchemy import Date, and_, bindparam, func, or_, select, text
+from sqlalchemy.orm import Session, contains_eager, joinedload
+
+from .cache import LRUCache
+from .config import settings
+from .models import City, CityLatest, Data
+from .schemas import CreateCity, CreateData, ReadCity
+
+# province -> ReadCity，缓存列的值而不是 ORM 对象，可以跨 Session 使用
+city_cache = LRUCache(maxsize=settings.city_cache_size, ttl=settings.city_cache_ttl, enabled=settings.city_cache)
+
+# 进程内的写入计数和最后写入时间，和数据库中的统计一起作为 ETag / Last-Modified
+_write_counter = count(1)
+write_state = {'generation': 0, 'at': None}
+
+
+def mark_written():
+    """每次写入后调用"""
+    write_state['generation'] = next(_write_counter)
+    write_state['at'] = datetime.utcnow().replace(microsecond=0)
 
 
 def get_city(db: Session, city_id: int):
@@ -13,29 +35,320 @@ def get_city_by_name(db: Session, city_name: str):
     return db.query(City).filter(City.province == city_name).first()
 
 
-def get_cities(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(City).offset(skip).limit(limit).all()
+def get_city_info(db: Session, city_name: str) -> Optional[ReadCity]:
+    """按名称获取城市，优先读缓存，不存在时返回None（不缓存）"""
+    city = city_cache.get(city_name)
+    if city is None:
+        db_city = get_city_by_name(db, city_name)
+        if db_city is None:
+            return None
+        city = ReadCity.from_orm(db_city)
+        city_cache.set(city_name, city)
+    return city
+
+
+"""
+游标分页
+
+OFFSET 需要扫描并丢弃前面所有的行，页数越深越慢；
+游标记录上一页最后一行的排序键，下一页直接从索引上定位，每页代价相同
+"""
+
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> list:
+    """无效的游标抛出 ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('invalid cursor')
+    if not isinstance(values, list) or len(values) != 2 or not isinstance(values[1], int):
+        raise ValueError('invalid cursor')
+    return values
+
+
+def city_cursor(city: City) -> str:
+    return encode_cursor(city.country_code, city.id)
+
+
+def data_cursor(data: Data) -> str:
+    return encode_cursor(data.date.isoformat(), data.id)
+
+
+def next_cursor(rows: list, limit: int, cursor) -> Optional[str]:
+    """满页时返回下一页的游标"""
+    if rows and len(rows) >= limit:
+        return cursor(rows[-1])
+
+
+def city_after_clause(after: str):
+    """游标之后的城市，按 (country_code, id) 排序"""
+    country_code, city_id = decode_cursor(after)
+    # 范围条件单独写出来，才能在索引上定位
+    return and_(City.country_code >= country_code, or_(
+        City.country_code > country_code,
+        City.id > city_id
+    ))
+
+
+def get_cities(db: Session, skip: int = 0, limit: int = 10, after: str = None) -> List[City]:
+    # 按 (country_code, id) 排序，保证游标唯一
+    query = db.query(City).order_by(City.country_code, City.id)
+    if after:
+        query = query.filter(city_after_clause(after))
+    return query.offset(skip).limit(limit).all()
 
 
 def create_city(db: Session, city: CreateCity):
     db_city = City(**city.dict())
     db.add(db_city)
     db.commit()
+    city_cache.pop(db_city.province)
+    mark_written()
     db.refresh(db_city)
     return db_city
 
 
-def get_data(db: Session, city: str = None, skip: int = 0, limit: int = 10):
-    if city:
-        return db.query(Data).filter(Data.city.has(province=city))
+def data_after_clause(after: str):
+    """游标之后的数据，按 (date desc, id desc) 排序"""
+    day, data_id = decode_cursor(after)
+    try:
+        day = date.fromisoformat(day)
+    except (TypeError, ValueError):
+        raise ValueError('invalid cursor')
+    # 范围条件单独写出来，才能在索引上定位
+    return and_(Data.date <= day, or_(
+        Data.date < day,
+        Data.id < data_id
+    ))
+
 
+def get_data(db: Session, city: str = None, skip: int = 0, limit: int = 10, after: str = None) -> List[Data]:
+    # 关联的City在同一条SQL中加载，避免模板中 row.city 逐行查询（N+1）
+    if city:
+        query = db.query(Data).join(Data.city).options(contains_eager(Data.city)).filter(City.province == city)
     else:
-        return db.query(Data).offset(skip).limit(limit).all()
+        query = db.query(Data).options(joinedload(Data.city))
+
+    # 按 (date desc, id desc) 排序，保证游标唯一
+    query = query.order_by(Data.date.desc(), Data.id.desc())
+    if after:
+        query = query.filter(data_after_clause(after))
+
+    return query.offset(skip).limit(limit).all()
 
 
 def create_city_data(db: Session, data: CreateData, city_id: int):
     db_data = Data(**data.dict(), city_id=city_id)
     db.add(db_data)
+    upsert_city_latest(db, [dict(data.dict(), city_id=city_id)])
     db.commit()
+    mark_written()
     db.refresh(db_data)
     return db_data
+
+
+def data_version_query(city_id: int = None):
+    """
+    最大id、最后更新时间，按城市过滤时再加上行数，都只读索引
+    不过滤时分成子查询，才能用上 max 的优化，只读索引的一端
+    """
+    if city_id is None:
+        return select([
+            select([func.max(Data.id)]).as_scalar(),
+            select([func.max(Data.updated_at)]).as_scalar(),
+        ])
+    return select([func.max(Data.id), func.max(Data.updated_at), func.count(Data.id)]).where(Data.city_id == city_id)
+
+
+def get_data_version(db: Session, city: str = None) -> Tuple[str, Optional[datetime]]:
+    """
+    返回 (版本, 最后修改时间)，用于条件请求
+    只做一次聚合查询，不加载 ORM 对象；城市不存在时没有数据
+    """
+    if city:
+        db_city = get_city_info(db, city)
+        if db_city is None:
+            return f'none-{write_state["generation"]}', write_state['at']
+        row = db.execute(data_version_query(db_city.id)).first()
+    else:
+        row = db.execute(data_version_query()).first()
+    return data_version(*row)
+
+
+def data_version(max_id: Optional[int], updated_at: Optional[datetime], rows: int = None) -> Tuple[str, Optional[datetime]]:
+    last_modified = max(filter(None, (updated_at, write_state['at'])), default=None)
+    version = f'{max_id or 0}-{updated_at.isoformat() if updated_at else ""}-{rows}-{write_state["generation"]}'
+    return version, last_modified
+
+
+def get_timeline(db: Session, city_id: int, start: date = None, end: date = None) -> list:
+    """城市的时间线 (date, confirmed, deaths, recovered)，按日期正序，只读覆盖索引"""
+    query = select([Data.date, Data.confirmed, Data.deaths, Data.recovered]).where(Data.city_id == city_id)
+    if start:
+        query = query.where(Data.date >= start)
+    if end:
+        query = query.where(Data.date <= end)
+    return db.execute(query.order_by(Data.date)).fetchall()
+
+
+# 导出的列，和 ix_data_city_id_date_covering 一起只读索引（City 按主键查找）
+EXPORT_COLUMNS = (
+    Data.id, Data.city_id, City.province, Data.date, Data.confirmed, Data.deaths, Data.recovered, Data.updated_at,
+)
+
+
+def iter_export(db: Session, city_id: int = None, chunk_size: int = 1000) -> Iterator[list]:
+    """
+    按 (city_id, date, id) 顺序分块返回导出的行，每块最多 chunk_size 行
+    不加载 ORM 对象，游标逐块 fetchmany，内存占用和总行数无关
+    """
+    query = select(EXPORT_COLUMNS).select_from(Data.__table__.join(City.__table__))
+    if city_id is not None:
+        query = query.where(Data.city_id == city_id)
+    query = query.order_by(Data.city_id, Data.date, Data.id)
+
+    result = db.execute(query.execution_options(stream_results=True))
+    try:
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        result.close()
+
+
+"""
+最新数据汇总
+
+city_latest 每个城市一行，保存日期最新的一条数据，写入 Data 的同一个事务中更新，
+查询国家/全球最新数据时只读汇总表，不再按城市扫描历史数据
+"""
+
+# SQLAlchemy 1.3 的 sqlite 方言不支持 on_conflict，直接写 upsert（SQLite 3.24+）
+# 日期不早于已有数据时才覆盖，同一天后写入的覆盖先写入的，和 get_data 的排序一致
+upsert_latest = text("""
+INSERT INTO city_latest (city_id, date, confirmed, deaths, recovered, updated_at)
+VALUES (:city_id, :date, :confirmed, :deaths, :recovered, CURRENT_TIMESTAMP)
+ON CONFLICT (city_id) DO UPDATE SET
+    date = excluded.date,
+    confirmed = excluded.confirmed,
+    deaths = excluded.deaths,
+    recovered = excluded.recovered,
+    updated_at = excluded.updated_at
+WHERE excluded.date >= city_latest.date
+""").bindparams(bindparam('date', type_=Date))
+
+# 每个城市按 (date desc, id desc) 的第一行，走 ix_data_city_id_date_covering
+rebuild_latest = text("""
+INSERT INTO city_latest (city_id, date, confirmed, deaths, recovered, updated_at)
+SELECT data.city_id, data.date, data.confirmed, data.deaths, data.recovered, CURRENT_TIMESTAMP
+FROM city JOIN data ON data.id = (
+    SELECT id FROM data WHERE data.city_id = city.id ORDER BY date DESC, id DESC LIMIT 1
+)
+""")
+
+
+def latest_rows(rows: Iterable[dict]) -> List[dict]:
+    """每个城市日期最新的一行，同一天取后面的"""
+    latest = {}
+    for row in rows:
+        current = latest.get(row['city_id'])
+        if current is None or row['date'] >= current['date']:
+            latest[row['city_id']] = row
+    return [
+        {
+            'city_id': row['city_id'],
+            'date': row['date'],
+            'confirmed': row.get('confirmed', 0),
+            'deaths': row.get('deaths', 0),
+            'recovered': row.get('recovered', 0),
+        }
+        for row in latest.values()
+    ]
+
+
+def upsert_city_latest(db: Session, rows: Iterable[dict]):
+    """用新写入的数据更新汇总表，不提交，和数据在同一个事务中提交"""
+    rows = latest_rows(rows)
+    if rows:
+        db.execute(upsert_latest, rows)
+
+
+def backfill_city_latest(db: Session) -> bool:
+    """汇总表为空时（新增汇总表之前的数据库）从 Data 重建，返回是否重建"""
+    if db.execute(select([CityLatest.city_id]).limit(1)).first() is not None:
+        return False
+    db.execute(rebuild_latest)
+    db.commit()
+    return True
+
+
+def get_latest(db: Session, country_code: str = None):
+    """
+    国家或全球最新数据的合计 (cities, date, confirmed, deaths, recovered)
+    汇总表每个城市只有一行，按国家过滤时走 ix_city_country_code
+    """
+    query = select([
+        func.count(CityLatest.city_id).label('cities'),
+        func.max(CityLatest.date).label('date'),
+        func.coalesce(func.sum(CityLatest.confirmed), 0).label('confirmed'),
+        func.coalesce(func.sum(CityLatest.deaths), 0).label('deaths'),
+        func.coalesce(func.sum(CityLatest.recovered), 0).label('recovered'),
+    ])
+    if country_code:
+        query = query.select_from(CityLatest.__table__.join(City.__table__)).where(City.country_code == country_code)
+    return db.execute(query).first()
+
+
+"""
+批量写入
+
+逐行 add/commit/refresh 每行要一次往返、一次提交和一次 SELECT，
+批量接口直接走 Core 的 executemany，每 chunk_size 行提交一次
+"""
+
+
+def get_city_ids(db: Session) -> Dict[str, int]:
+    """province -> id"""
+    return dict(db.execute(select([City.province, City.id])).fetchall())
+
+
+def insert_city(db: Session, city: dict) -> int:
+    """插入城市并返回id，不提交，随下一批数据一起提交"""
+    result = db.execute(City.__table__.insert(), city)
+    city_cache.pop(city['province'])
+    return result.inserted_primary_key[0]
+
+
+def delete_city_data(db: Session, city_id: int):
+    """删除城市的全部数据和汇总，不提交"""
+    db.execute(Data.__table__.delete().where(Data.city_id == city_id))
+    db.execute(CityLatest.__table__.delete().where(CityLatest.city_id == city_id))
+
+
+def bulk_create_data(db: Session, rows: Iterable[dict], chunk_size: int = 5000) -> int:
+    """
+    rows 可以是生成器，按 chunk_size 分批 executemany，每批一个事务，返回写入行数
+    每批数据同时更新汇总表
+    """
+    rows = iter(rows)
+    total = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        db.execute(Data.__table__.insert(), chunk)
+        upsert_city_latest(db, chunk)
+        db.commit()
+        mark_written()
+        total += len(chunk)
+    # 最后一批可能只有删除或新建城市，没有数据
+    db.commit()
+    mark_written()
+    return total
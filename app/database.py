@@ -12,21 +12,120 @@ SQLAlchemy 基础知识 - autoflush 和 autocommit
 https://zhuanlan.zhihu.com/p/48994990
 
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
-DATABASE_URL = 'sqlite:///data.sqlite'
+from .config import settings
+
+DATABASE_URL = settings.database_url
+
+"""
+引擎配置
+
+dev：打印 SQL，默认的 rollback 日志；SQLAlchemy 1.3 中文件数据库默认使用 NullPool，每次请求新建连接
+prod：不打印 SQL，使用 WAL（读写互不阻塞）、连接池（连接和页缓存可以复用），启动时预热
+
+pragma 文档：https://www.sqlite.org/pragma.html
+"""
+PROFILES = {
+    'dev': {
+        'echo': True,
+        'pool': False,
+        'warm_up': False,
+        'pragmas': {},
+    },
+    'prod': {
+        'echo': False,
+        'pool': True,
+        'warm_up': True,
+        'pragmas': {
+            'journal_mode': 'WAL',
+            # WAL 模式下 NORMAL 不会损坏数据库，只有断电时可能丢失最近的事务
+            'synchronous': 'NORMAL',
+            # 负数单位为 KiB，即每个连接 64MB 页缓存
+            'cache_size': -64000,
+            'mmap_size': 256 * 1024 * 1024,
+            'temp_store': 'MEMORY',
+            # 写锁被占用时等待的毫秒数，而不是立即报 database is locked
+            'busy_timeout': 5000,
+        },
+    },
+}
+
+
+def get_profile(name: str = None) -> dict:
+    profile = PROFILES[name or settings.db_profile]
+    return dict(profile, pragmas=dict(profile['pragmas'], **settings.db_pragmas))
+
+
+def apply_pragmas(dbapi_connection, pragmas: dict):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+    finally:
+        cursor.close()
 
-# doc: https://docs.sqlalchemy.org/en/13/core/engines.html#sqlalchemy.create_engine
-engine = create_engine(
-    DATABASE_URL,
-    encoding='utf-8',
-    echo=True,  # 打印sql
-    connect_args={
-        'check_same_thread': False  # sqlite数据库，让任意线程可以使用
-    }
-)
+
+def make_engine(url: str = DATABASE_URL, profile: str = None) -> Engine:
+    """按 profile 创建引擎，pragma 在每个新建的连接上执行"""
+    profile = get_profile(profile)
+    kwargs = {}
+    # 内存数据库只能使用默认的单连接池
+    if profile['pool'] and make_url(url).database not in (None, '', ':memory:'):
+        kwargs.update(
+            poolclass=QueuePool,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+        )
+
+    # doc: https://docs.sqlalchemy.org/en/13/core/engines.html#sqlalchemy.create_engine
+    engine = create_engine(
+        url,
+        encoding='utf-8',
+        echo=profile['echo'],  # 打印sql
+        connect_args={
+            'check_same_thread': False  # sqlite数据库，让任意线程可以使用
+        },
+        **kwargs
+    )
+
+    pragmas = profile['pragmas']
+    if pragmas:
+        @event.listens_for(engine, 'connect')
+        def on_connect(dbapi_connection, connection_record):
+            apply_pragmas(dbapi_connection, pragmas)
+
+    return engine
+
+
+def warm_up(bind: Engine = None):
+    """
+    预先建立连接池中的连接，并顺序读一遍各个表和索引，把数据页读入页缓存（mmap 时为系统缓存，各连接共享）
+    需要在建表之后调用
+    """
+    bind = bind or engine
+    size = bind.pool.size() if isinstance(bind.pool, QueuePool) else 1
+    connections = [bind.connect() for _ in range(size)]
+    try:
+        tables = set(inspect(bind).get_table_names())
+        for table in Base.metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            connections[0].execute(text(f'SELECT count(*) FROM {table.name} NOT INDEXED'))
+            for index in table.indexes:
+                connections[0].execute(text(f'SELECT count(*) FROM {table.name} INDEXED BY {index.name}'))
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+engine = make_engine()
 
 # crud通过session会话进行
 Session = sessionmaker(
@@ -40,6 +139,22 @@ Session = sessionmaker(
 Base = declarative_base(bind=engine, name="Base")
 
 
+def upgrade_schema(bind=engine):
+    """
+    create_all 只会创建不存在的表，已有的 data.sqlite 不会得到新增的索引，这里补建缺失的索引
+    需要在导入 models 之后调用
+    """
+    inspector = inspect(bind)
+    table_names = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in table_names:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=bind)
+
+
 async def get_db():
     db = Session()
     try:
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+时间序列降采样
+
+Largest-Triangle-Three-Buckets（LTTB）：把序列分成若干桶，每个桶选出和前一个选中点、
+下一个桶的平均点组成的三角形面积最大的点，保留曲线的形状（峰值、拐点）
+
+需要安装 pip install numpy
+"""
+import numpy as np
+
+
+def lttb(x: np.ndarray, ys: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    x: (n,) 递增的横坐标
+    ys: (n, k) k 条序列，一次计算
+    返回 (threshold, k) 每条序列选中点的下标，点数不超过 threshold 时返回全部下标
+    """
+    n, k = ys.shape
+    if threshold >= n or threshold < 3:
+        return np.repeat(np.arange(n)[:, None], k, axis=1)
+
+    x = x.astype(np.float64)
+    ys = ys.astype(np.float64)
+    columns = np.arange(k)
+
+    indices = np.empty((threshold, k), dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    # 首尾两点之外的点平均分到 threshold - 2 个桶中，edges[i]:edges[i + 1] 为第 i 个桶
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    # 最后一个桶的下一个"桶"是最后一个点
+    edges = np.append(edges, n)
+
+    selected = np.zeros(k, dtype=np.int64)
+    for i in range(threshold - 2):
+        start, end, next_end = edges[i], edges[i + 1], edges[i + 2]
+
+        # 下一个桶的平均点 (k,)
+        avg_x = x[end:next_end].mean()
+        avg_y = ys[end:next_end].mean(axis=0)
+
+        # 上一个选中的点 (k,)
+        a_x = x[selected]
+        a_y = ys[selected, columns]
+
+        # 桶内每个点和 A、平均点组成的三角形面积（的两倍） (m, k)
+        b_x = x[start:end, None]
+        b_y = ys[start:end]
+        area = np.abs((a_x - avg_x) * (b_y - a_y) - (a_x - b_x) * (avg_y - a_y))
+
+        selected = start + area.argmax(axis=0)
+        indices[i + 1] = selected
+
+    return indices
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Data 导出
+
+crud.iter_export 分块读取，这里逐块编码为 NDJSON 或 CSV，交给 StreamingResponse 边查边发送，
+第一个字节的时间和内存占用都和导出的总行数无关
+"""
+import csv
+import io
+import json
+from typing import Iterable, Iterator
+
+from . import crud
+
+COLUMNS = [column.key for column in crud.EXPORT_COLUMNS]
+
+MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def _default(value):
+    # date / datetime
+    return value.isoformat()
+
+
+def ndjson_chunks(chunks: Iterable[list]) -> Iterator[bytes]:
+    for rows in chunks:
+        yield ''.join(
+            json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False, default=_default) + '\n' for row in rows
+        ).encode()
+
+
+def csv_chunks(chunks: Iterable[list]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # 没有数据时只有表头
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+ENCODERS = {
+    'ndjson': ndjson_chunks,
+    'csv': csv_chunks,
+}
+
+
+def export_chunks(session_factory, fmt: str, city_id: int = None, chunk_size: int = 1000) -> Iterator[bytes]:
+    """
+    在自己的 Session 中查询，响应发送完（或客户端断开）后关闭
+    请求的 Session 在路由返回后就可能被关闭，不能给流式响应使用
+    """
+    db = session_factory()
+    try:
+        yield from ENCODERS[fmt](crud.iter_export(db, city_id=city_id, chunk_size=chunk_size))
+    finally:
+        db.close()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+数据源解析
+
+格式见 app/data.json：
+{
+    "latest": {...},
+    "locations": [
+        {"province": ..., "country": ..., "timelines": {"confirmed": {"timeline": {"2020-01-22T00:00:00Z": 14, ...}}, ...}},
+        ...
+    ]
+}
+
+json.load 会把整个文档一次性读进内存，这里按块读取文件，每次只解码一个 location，
+内存占用只和单个 location 的大小有关，和文件大小无关
+"""
+import codecs
+import json
+from datetime import date
+from typing import IO, Iterable, Iterator, Tuple
+
+_decoder = json.JSONDecoder()
+
+_WHITESPACE = ' \t\n\r'
+
+
+def parse_date(value: str) -> date:
+    """'2020-01-22T00:00:00Z' -> date(2020, 1, 22)"""
+    return date(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+
+
+class _Reader(object):
+    """按块读取文本，在缓冲区上用 raw_decode 逐个解码 JSON 值"""
+
+    def __init__(self, fp: IO, chunk_size: int):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self._decode = None
+
+    def _fill(self, size: int) -> bool:
+        if self.eof:
+            return False
+        data = self.fp.read(size)
+        if isinstance(data, bytes):
+            if self._decode is None:
+                self._decode = codecs.getincrementaldecoder('utf-8')().decode
+            raw, data = data, self._decode(data, final=not data)
+            # 块边界切开了多字节字符时继续读
+            while raw and not data:
+                raw = self.fp.read(size)
+                data = self._decode(raw, final=not raw)
+        if not data:
+            self.eof = True
+            return False
+        # 丢弃已经消费的部分
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """跳过空白，返回下一个字符，结束时返回空串"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill(self.chunk_size):
+                return ''
+
+    def next_char(self) -> str:
+        ch = self.peek()
+        if not ch:
+            raise ValueError('unexpected end of feed')
+        self.pos += 1
+        return ch
+
+    def expect(self, expected: str):
+        ch = self.next_char()
+        if ch != expected:
+            raise ValueError(f'expected {expected!r} at offset {self.pos}, got {ch!r}')
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # 值不完整，加倍读取后重新解码，避免大值反复重解析
+                if not self._fill(max(self.chunk_size, len(self.buf) - self.pos)):
+                    raise
+                continue
+            # 数字可能在缓冲区末尾被截断
+            if end == len(self.buf) and self._fill(self.chunk_size):
+                continue
+            self.pos = end
+            return obj
+
+
+def iter_locations(fp: IO, chunk_size: int = 64 * 1024) -> Iterator[dict]:
+    """逐个返回 locations 数组中的元素，其他顶层字段跳过"""
+    reader = _Reader(fp, chunk_size)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == 'locations':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.next_char()
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.next_char() == ']':
+                        break
+        else:
+            reader.value()
+
+        if reader.next_char() == '}':
+            break
+
+
+def location_rows(timelines: dict) -> Iterator[Tuple[date, int, int, int]]:
+    """一个 location 的时间线 -> (date, confirmed, deaths, recovered)"""
+    timelines = timelines or {}
+    confirmed = (timelines.get('confirmed') or {}).get('timeline') or {}
+    deaths = (timelines.get('deaths') or {}).get('timeline') or {}
+    recovered = (timelines.get('recovered') or {}).get('timeline') or {}
+
+    # 三个时间线的日期取并集，保持原有顺序
+    keys = dict.fromkeys(confirmed)
+    keys.update(dict.fromkeys(deaths))
+    keys.update(dict.fromkeys(recovered))
+
+    for key in keys:
+        yield parse_date(key), confirmed.get(key, 0), deaths.get(key, 0), recovered.get(key, 0)
+
+
+def rows_from_locations(locations: Iterable[dict]) -> Iterator[Tuple[dict, date, int, int, int]]:
+    """
+    (location, date, confirmed, deaths, recovered)
+    同一个 location 的行是连续的，location 为去掉 timelines 后的字典
+    """
+    for location in locations:
+        timelines = location.pop('timelines', None)
+        for day, confirmed, deaths, recovered in location_rows(timelines):
+            yield location, day, confirmed, deaths, recovered
+
+
+def iter_rows(fp: IO, chunk_size: int = 64 * 1024) -> Iterator[Tuple[dict, date, int, int, int]]:
+    return rows_from_locations(iter_locations(fp, chunk_size=chunk_size))
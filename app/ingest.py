@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+NDJSON 批量写入
+
+请求体每行一条 JSON：{"city": "Beijing", "date": "2021-01-06", "confirmed": 1, "deaths": 0, "recovered": 0}
+city 可以省略，使用查询参数中的 city
+
+请求体按块读取、按行切分，每 batch_size 行校验一次并在一个事务中写入，
+内存占用只和批大小有关，和上传的总行数无关
+"""
+import json
+from typing import AsyncIterator, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import crud
+from .schemas import CreateData
+
+# 每批最多返回的错误数
+MAX_ERRORS = 10
+
+
+async def iter_lines(stream: AsyncIterator[bytes], max_line: int) -> AsyncIterator[Optional[bytes]]:
+    """按行切分字节流，超过 max_line 的行不保留内容，返回 None"""
+    buffer = b''
+    skipping = False
+    async for chunk in stream:
+        lines = (buffer + chunk).split(b'\n')
+        buffer = lines.pop()
+        for line in lines:
+            if skipping:
+                # 超长行的结尾
+                skipping = False
+                yield None
+            elif len(line) > max_line:
+                yield None
+            else:
+                yield line
+        if len(buffer) > max_line:
+            buffer = b''
+            skipping = True
+
+    if skipping or len(buffer) > max_line:
+        yield None
+    elif buffer:
+        yield buffer
+
+
+def parse_record(line: Optional[bytes], city: str = None) -> Tuple[str, CreateData]:
+    """返回 (城市名, 数据)，格式错误时抛出 ValueError"""
+    if line is None:
+        raise ValueError('line too long')
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError('record must be an object')
+    city = record.pop('city', None) or city
+    if not city:
+        raise ValueError('city is required')
+    return city, CreateData.parse_obj(record)
+
+
+def ingest_batch(db: Session, lines: List[Tuple[int, Optional[bytes]]], city: str = None) -> dict:
+    """lines 为 [(行号, 行)]，校验并在一个事务中写入，返回写入和拒绝的行数"""
+    rows = []
+    rejected = 0
+    errors = []
+    city_ids = {}
+    for number, line in lines:
+        try:
+            name, data = parse_record(line, city)
+            if name not in city_ids:
+                db_city = crud.get_city_info(db, name)
+                city_ids[name] = db_city.id if db_city else None
+            if city_ids[name] is None:
+                raise ValueError(f'city not found: {name}')
+        except ValueError as e:
+            rejected += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append({'line': number, 'error': str(e)})
+            continue
+        rows.append(dict(data.dict(), city_id=city_ids[name]))
+
+    if rows:
+        crud.bulk_create_data(db, rows, chunk_size=len(rows))
+    return {'accepted': len(rows), 'rejected': rejected, 'errors': errors}
+
+
+async def ingest_stream(db: Session, stream: AsyncIterator[bytes], city: str = None,
+                        batch_size: int = 1000, max_line: int = 65536) -> dict:
+    """读取 NDJSON 字节流并分批写入，数据库操作在线程池中执行，返回每批的统计"""
+    result = {'lines': 0, 'accepted': 0, 'rejected': 0, 'batches': []}
+
+    async def flush(batch):
+        stats = await run_in_threadpool(ingest_batch, db, batch, city)
+        result['accepted'] += stats['accepted']
+        result['rejected'] += stats['rejected']
+        result['batches'].append(dict(stats, batch=len(result['batches']) + 1, lines=len(batch)))
+
+    batch = []
+    async for line in iter_lines(stream, max_line):
+        result['lines'] += 1
+        # 跳过空行，行号仍然计数
+        if line is not None and not line.strip():
+            continue
+        batch.append((result['lines'], line))
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    return result
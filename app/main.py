@@ -1,22 +1,62 @@
 # -*- coding: utf-8 -*-
+from contextlib import closing
 from pprint import pprint
 
-from fastapi.templating import Jinja2Templates
+from datetime import date
+
+import numpy as np
+from fastapi.responses import StreamingResponse
 from fastapi import APIRouter, Request, Response, Depends, HTTPException, status, Query, Body, BackgroundTasks
 from sqlalchemy.orm import Session
 from typing import Optional, List
 from pydantic import HttpUrl
 from .schemas import CreateCity, CreateData, ReadCity, ReadData
-from .database import Base, engine, get_db
+from .database import Base, engine, get_db, upgrade_schema
+from .config import settings
 import requests
 
-from . import crud
+from . import columnar, conditional, crud, database, downsample, export, ingest, rendering, sync
 
 app07 = APIRouter()
 
-templates = Jinja2Templates(directory='app/templates')
+templates = rendering.make_templates(directory='app/templates', names=['home.html'])
 
 Base.metadata.create_all(bind=engine)
+upgrade_schema(bind=engine)
+# 已有的数据库补齐最新数据汇总
+with closing(database.Session()) as _db:
+    crud.backfill_city_latest(_db)
+if database.get_profile()['warm_up']:
+    database.warm_up(engine)
+
+
+# 游标分页：下一页的游标放在响应头中，通过 after 参数传回
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def invalid_cursor():
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='invalid cursor')
+
+
+def data_validators(request: Request, version: str, last_modified, media_type: str = None) -> dict:
+    """数据版本相同的同一个地址（含查询参数）内容相同，按 Accept 协商格式时不同格式的 ETag 不同"""
+    etag = conditional.make_etag(version, request.url.path, request.url.query, media_type or '')
+    headers = conditional.validators(etag, last_modified)
+    if media_type:
+        headers['Vary'] = 'Accept'
+    return headers
+
+
+# Data 的读接口可以通过 Accept 选择列式格式，见 columnar 模块
+DATA_MEDIA_TYPES = (columnar.DEFAULT, columnar.COLUMNAR_JSON, columnar.COLUMNAR_BINARY)
+
+
+def data_media_type(request: Request) -> str:
+    return columnar.negotiate(request.headers.get('accept'), DATA_MEDIA_TYPES)
+
+
+def columnar_response(data: list, media_type: str, headers: dict) -> Response:
+    return Response(columnar.ENCODERS[media_type](data), media_type=media_type, headers=headers)
 
 
 @app07.get('/')
@@ -24,23 +64,37 @@ def index(request: Request,
           city: str = None,
           skip: int = 0,
           limit: int = 10,
+          after: str = None,
           db: Session = Depends(get_db)):
-    print('index')
+    # 数据没有变化时不查询、不渲染
+    version, last_modified = crud.get_data_version(db=db, city=city)
+    headers = data_validators(request, version, last_modified)
+    if conditional.is_not_modified(request, headers['ETag'], last_modified):
+        return conditional.not_modified_response(headers)
+
+    try:
+        data = crud.get_data(db=db, city=city, skip=skip, limit=limit, after=after)
+    except ValueError:
+        raise invalid_cursor()
 
-    data = crud.get_data(db=db, city=city, skip=skip, limit=limit)
+    return render_home(request, data, city, limit, headers)
 
-    print(data)
 
-    return templates.TemplateResponse('home.html', {
+def render_home(request: Request, data: list, city: Optional[str], limit: int, headers: dict):
+    """边渲染边发送，数据多时首字节不用等整个页面渲染完"""
+    return rendering.stream_template(templates, 'home.html', {
         'request': request,
         'data': data,
+        'city': city,
+        'limit': limit,
+        'next_cursor': crud.next_cursor(data, limit, crud.data_cursor),
         'sync_data_url': 'url'
-    })
+    }, headers=headers)
 
 
 @app07.post('/createCity', response_model=ReadCity)
 def create_city(city: CreateCity, db: Session = Depends(get_db)):
-    db_city = crud.get_city_by_name(db=db, city_name=city.province)
+    db_city = crud.get_city_info(db=db, city_name=city.province)
     if db_city:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='city is exists')
 
@@ -49,7 +103,7 @@ def create_city(city: CreateCity, db: Session = Depends(get_db)):
 
 @app07.get('/getCity/{city}', response_model=ReadCity)
 def get_city(city: str, db: Session = Depends(get_db)):
-    db_city = crud.get_city_by_name(db=db, city_name=city)
+    db_city = crud.get_city_info(db=db, city_name=city)
     if db_city is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='city not found')
     else:
@@ -57,25 +111,144 @@ def get_city(city: str, db: Session = Depends(get_db)):
 
 
 @app07.post('/getCites', response_model=List[ReadCity])
-def get_cites(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    return crud.get_cities(db=db, skip=skip, limit=limit)
+def get_cites(response: Response, skip: int = 0, limit: int = 10, after: str = None, db: Session = Depends(get_db)):
+    try:
+        cities = crud.get_cities(db=db, skip=skip, limit=limit, after=after)
+    except ValueError:
+        raise invalid_cursor()
+
+    cursor = crud.next_cursor(cities, limit, crud.city_cursor)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+    return cities
 
 
 @app07.post('/createData', response_model=ReadData)
 def create_data(data: CreateData, city: str, db: Session = Depends(get_db)):
-    db_city = crud.get_city_by_name(db=db, city_name=city)
+    db_city = crud.get_city_info(db=db, city_name=city)
+    if db_city is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='city not found')
     return crud.create_city_data(db=db, data=data, city_id=db_city.id)
 
 
+@app07.post('/ingestData')
+async def ingest_data(request: Request, city: str = None, db: Session = Depends(get_db)):
+    """
+    NDJSON 流式批量写入，每行一条数据，没有 city 字段时使用查询参数 city
+    请求体不会整体读入内存，返回每批写入和拒绝的行数
+    """
+    return await ingest.ingest_stream(db, request.stream(), city=city,
+                                      batch_size=settings.ingest_batch_size, max_line=settings.ingest_max_line)
+
+
 @app07.get('/get_data')
-def get_data(city: str = None, skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    data = crud.get_data(db=db, city=city, skip=skip, limit=limit)
+def get_data(request: Request,
+             response: Response,
+             city: str = None,
+             skip: int = 0,
+             limit: int = 10,
+             after: str = None,
+             db: Session = Depends(get_db)):
+    media_type = data_media_type(request)
+    version, last_modified = crud.get_data_version(db=db, city=city)
+    headers = data_validators(request, version, last_modified, media_type)
+    if conditional.is_not_modified(request, headers['ETag'], last_modified):
+        return conditional.not_modified_response(headers)
+
+    try:
+        data = crud.get_data(db=db, city=city, skip=skip, limit=limit, after=after)
+    except ValueError:
+        raise invalid_cursor()
+
+    cursor = crud.next_cursor(data, limit, crud.data_cursor)
+    if cursor:
+        headers[NEXT_CURSOR_HEADER] = cursor
+    if media_type != columnar.DEFAULT:
+        return columnar_response(data, media_type, headers)
+
+    response.headers.update(headers)
     return data
 
 
+@app07.get('/export')
+def export_data(city: str = None,
+                fmt: str = Query('ndjson', alias='format', regex='^(ndjson|csv)$'),
+                db: Session = Depends(get_db)):
+    """流式导出全部（或一个城市的）数据，NDJSON 或 CSV"""
+    city_id = None
+    if city:
+        db_city = crud.get_city_info(db=db, city_name=city)
+        if db_city is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='city not found')
+        city_id = db_city.id
+
+    # 响应在路由返回后才开始发送，使用同一个数据库的新 Session
+    chunks = export.export_chunks(lambda: database.Session(bind=db.get_bind()), fmt,
+                                  city_id=city_id, chunk_size=settings.export_chunk_size)
+    return StreamingResponse(chunks, media_type=export.MEDIA_TYPES[fmt], headers={
+        'Content-Disposition': f'attachment; filename="data.{fmt}"',
+    })
+
+
+TIMELINE_SERIES = ('confirmed', 'deaths', 'recovered')
+
+
+@app07.get('/timeline')
+def get_timeline(city: str,
+                 start: date = None,
+                 end: date = None,
+                 points: int = Query(300, ge=3, le=5000, description='每条序列最多返回的点数'),
+                 db: Session = Depends(get_db)):
+    """城市的时间线，服务端用 LTTB 降采样，供图表使用"""
+    db_city = crud.get_city_info(db=db, city_name=city)
+    if db_city is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='city not found')
+
+    rows = crud.get_timeline(db=db, city_id=db_city.id, start=start, end=end)
+    series = {name: {'date': [], 'value': []} for name in TIMELINE_SERIES}
+    if rows:
+        dates = [row[0] for row in rows]
+        x = np.fromiter((day.toordinal() for day in dates), dtype=np.int64, count=len(rows))
+        ys = np.array([row[1:] for row in rows], dtype=np.int64)
+        indices = downsample.lttb(x, ys, points)
+        for column, name in enumerate(TIMELINE_SERIES):
+            selected = indices[:, column]
+            series[name]['date'] = [dates[i].isoformat() for i in selected]
+            series[name]['value'] = ys[selected, column].tolist()
+
+    return {
+        'city': city,
+        'start': start,
+        'end': end,
+        'total': len(rows),
+        'points': len(series['confirmed']['date']),
+        'series': series,
+    }
+
+
+@app07.get('/latest')
+def get_latest(country_code: str = None, db: Session = Depends(get_db)):
+    """国家（country_code）或全球最新数据的合计，只读汇总表"""
+    row = crud.get_latest(db=db, country_code=country_code)
+    return {
+        'country_code': country_code,
+        'cities': row.cities,
+        'date': row.date,
+        'latest': {name: row[name] for name in TIMELINE_SERIES},
+    }
+
+
+@app07.get('/cache')
+def cache_info():
+    """缓存命中统计"""
+    return {'city': crud.city_cache.info()}
+
+
 # 不要再后台任务导入依赖
 def sync_data_task(db: Session):
-    pass
+    stats = sync.sync_file(db, settings.sync_data_file, chunk_size=settings.sync_chunk_size)
+    print('sync done: {locations} locations, {rows} rows in {seconds:.2f}s, {rows_per_sec:.0f} rows/s'.format(**stats))
+    return stats
 
 
 @app07.get('/sync')
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+进程内指标
+
+按路由模板（/chapter07/getCity/{city}，而不是实际路径）、请求方法和状态码统计请求耗时的直方图，
+以及正在处理的请求数、线程池占用，以 Prometheus 文本格式输出：
+https://prometheus.io/docs/instrumenting/exposition_formats/
+
+    histogram_quantile(0.99, sum by (route, le) (rate(http_request_duration_seconds_bucket[5m])))
+
+中间件和 /metrics 都在事件循环中运行，计数不需要加锁
+"""
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from starlette.routing import Mount
+
+# 秒
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram(object):
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # 最后一个为 +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """在桶内线性插值估算分位数，和 Prometheus 的 histogram_quantile 相同"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                if i == len(self.buckets):
+                    # 落在 +Inf 桶中，返回最大的有限上界
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class HistogramFamily(object):
+    """同一个指标名、不同标签值的一组直方图"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...],
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.children = {}  # type: Dict[Tuple[str, ...], Histogram]
+
+    def labels(self, *values: str) -> Histogram:
+        histogram = self.children.get(values)
+        if histogram is None:
+            histogram = self.children[values] = Histogram(self.buckets)
+        return histogram
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for values, histogram in sorted(self.children.items()):
+            labels = _labels(zip(self.labelnames, values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}'
+            yield f'{self.name}_sum{{{labels}}} {histogram.sum}'
+            yield f'{self.name}_count{{{labels}}} {histogram.count}'
+
+
+class CounterFamily(object):
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.children = {}  # type: Dict[Tuple[str, ...], float]
+
+    def inc(self, *values: str, amount: float = 1):
+        self.children[values] = self.children.get(values, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for values, value in sorted(self.children.items()):
+            yield f'{self.name}{{{_labels(zip(self.labelnames, values))}}} {value}'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(items) -> str:
+    return ','.join(f'{name}="{_escape(str(value))}"' for name, value in items)
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.histograms = []  # type: List[HistogramFamily]
+        self.counters = []  # type: List[CounterFamily]
+        self.gauges = []  # type: List[Tuple[str, str, Callable[[], float]]]
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...],
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> HistogramFamily:
+        family = HistogramFamily(name, documentation, labelnames, buckets)
+        self.histograms.append(family)
+        return family
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...]) -> CounterFamily:
+        family = CounterFamily(name, documentation, labelnames)
+        self.counters.append(family)
+        return family
+
+    def gauge(self, name: str, documentation: str, func: Callable[[], float]):
+        """func 在输出时调用"""
+        self.gauges.append((name, documentation, func))
+
+    def render(self) -> str:
+        lines = []
+        for name, documentation, func in self.gauges:
+            lines += [f'# HELP {name} {documentation}', f'# TYPE {name} gauge', f'{name} {func()}']
+        for family in self.counters + self.histograms:
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.histogram(
+    'http_request_duration_seconds', '请求耗时（秒）', ('route', 'method', 'status'))
+
+_state = {'in_flight': 0}
+registry.gauge('http_requests_in_flight', '正在处理的请求数', lambda: _state['in_flight'])
+
+
+def threadpool_usage() -> Tuple[int, int]:
+    """同步路由和依赖所在线程池的 (占用数, 大小)"""
+    try:
+        # starlette 0.15+ 使用 anyio，线程数由默认的 CapacityLimiter 限制
+        from anyio.to_thread import current_default_thread_limiter
+    except ImportError:
+        # 更早的版本使用事件循环默认的 ThreadPoolExecutor，只能得到已创建的线程数和排队的任务数
+        executor = asyncio.get_event_loop()._default_executor
+        if executor is None:
+            return 0, 0
+        return len(executor._threads) + executor._work_queue.qsize(), executor._max_workers
+    limiter = current_default_thread_limiter()
+    return limiter.borrowed_tokens, limiter.total_tokens
+
+
+registry.gauge('threadpool_busy', '线程池中正在运行的任务数', lambda: threadpool_usage()[0])
+registry.gauge('threadpool_size', '线程池大小', lambda: threadpool_usage()[1])
+
+
+# endpoint -> 路由模板
+_route_templates = {}
+
+
+def route_template(scope) -> str:
+    """路由匹配后 Router 会把 endpoint（Mount 为挂载的应用）写入 scope，据此找到路由模板"""
+    route = scope.get('route')
+    if route is not None:
+        return route.path
+    endpoint = scope.get('endpoint')
+    if endpoint is None:
+        return 'unmatched'
+    template = _route_templates.get(endpoint)
+    if template is None:
+        for route in scope['app'].routes:
+            if isinstance(route, Mount):
+                _route_templates.setdefault(route.app, route.path + '/{path}')
+            else:
+                _route_templates.setdefault(route.endpoint, route.path)
+        template = _route_templates.setdefault(endpoint, 'unmatched')
+    return template
+
+
+class MetricsMiddleware(object):
+    """纯 ASGI 中间件，不创建 Request/Response 对象"""
+
+    def __init__(self, app, histogram: HistogramFamily = REQUEST_DURATION):
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        _state['in_flight'] += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _state['in_flight'] -= 1
+            self.histogram.labels(route_template(scope), scope['method'], str(status_code)).observe(
+                time.perf_counter() - start)
+
+
+def summary(family: HistogramFamily = REQUEST_DURATION) -> list:
+    """每个路由的 p50/p95/p99（毫秒），便于直接查看"""
+    return [
+        dict(
+            zip(family.labelnames, values),
+            count=histogram.count,
+            **{f'p{q}_ms': round(histogram.quantile(q / 100) * 1000, 3) for q in (50, 95, 99)}
+        )
+        for values, histogram in sorted(family.children.items())
+    ]
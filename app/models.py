@@ -5,7 +5,7 @@ Navicat和PyCharm自带的SQLite客户端保存Date时间格式的时候会被
 SQLite本身没有时间格式，保存使用的是NUMERIC类型
 """
 
-from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Date, ForeignKey, func
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Date, ForeignKey, Index, func
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -27,6 +27,11 @@ class City(Base):
     # 默认正序，倒序排列 .desc()
     __mapper_args__ = {'order_by': country_code}
 
+    # SQLite 的索引隐含 rowid(id)，即按 (country_code, id) 排序，对应游标分页
+    __table_args__ = (
+        Index('ix_city_country_code', 'country_code'),
+    )
+
     def __repr__(self):
         return f'{self.country}_{self.province}'
 
@@ -49,5 +54,31 @@ class Data(Base):
     # 默认正序，倒序排列 .desc()
     __mapper_args__ = {'order_by': date.desc()}
 
+    __table_args__ = (
+        # 不按城市过滤时按 (date desc, id desc) 分页
+        Index('ix_data_date', 'date'),
+        # 按城市过滤并按 (date desc, id desc) 排序，同时覆盖列表展示的列，不用回表
+        Index('ix_data_city_id_date_covering', 'city_id', 'date', 'id', 'confirmed', 'deaths', 'recovered',
+              'updated_at'),
+        # 最后更新时间，用于条件请求的 Last-Modified
+        Index('ix_data_updated_at', 'updated_at'),
+    )
+
     def __repr__(self):
         return f'{repr(self.date)}_{self.confirmed}'
+
+
+class CityLatest(Base):
+    """每个城市最新一天的数据，写入 Data 时同步维护，查询最新数据时不用扫描历史"""
+    __tablename__ = 'city_latest'
+
+    city_id = Column(Integer, ForeignKey('city.id'), primary_key=True, comment='所属省/直辖市')
+    date = Column(Date, nullable=False, comment='数据日期')
+    confirmed = Column(BigInteger, default=0, nullable=False, comment='确诊数')
+    deaths = Column(BigInteger, default=0, nullable=False, comment='死亡数')
+    recovered = Column(BigInteger, default=0, nullable=False, comment='痊愈数')
+
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), comment='更新时间')
+
+    def __repr__(self):
+        return f'{self.city_id}_{repr(self.date)}_{self.confirmed}'
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+模板渲染
+
+TemplateResponse 先把整个页面渲染成一个字符串再发送，行数多时首字节慢、占用内存多；
+这里用 Template.generate 边渲染边发送，每凑满 chunk_size 个字符发送一次
+
+模板启动时编译，编译结果（字节码）缓存到文件，重启后不用重新编译：
+https://jinja.palletsprojects.com/en/2.11.x/api/#bytecode-cache
+"""
+from typing import Iterable, Iterator
+
+from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache, Template
+from starlette.responses import StreamingResponse
+
+from . import assets
+from .config import settings
+
+try:
+    from jinja2 import pass_context
+except ImportError:
+    # Jinja2 < 3.0
+    from jinja2 import contextfunction as pass_context
+
+
+def make_templates(directory: str, names: Iterable[str] = (), static_directory: str = 'static') -> Jinja2Templates:
+    """names 为启动时预先编译的模板"""
+    templates = Jinja2Templates(directory=directory)
+
+    # url_for('static', path=...) 使用加了哈希的文件，见 assets 模块
+    manifest = assets.load_manifest(static_directory)
+    if manifest:
+        url_for = templates.env.globals['url_for']
+
+        @pass_context
+        def asset_url_for(context, name: str, **path_params):
+            if name == 'static' and 'path' in path_params:
+                path_params['path'] = assets.asset_path(manifest, path_params['path'])
+            return url_for(context, name, **path_params)
+
+        templates.env.globals['url_for'] = asset_url_for
+
+    # 不指定目录时使用系统临时目录下当前用户的目录
+    templates.env.bytecode_cache = FileSystemBytecodeCache(settings.template_cache_dir or None)
+    # 为 False 时不再检查模板文件是否修改
+    templates.env.auto_reload = settings.template_auto_reload
+    for name in names:
+        templates.get_template(name)
+    return templates
+
+
+def iter_render(template: Template, context: dict, chunk_size: int = 8192) -> Iterator[bytes]:
+    buffer = []
+    size = 0
+    for text in template.generate(context):
+        buffer.append(text)
+        size += len(text)
+        if size >= chunk_size:
+            yield ''.join(buffer).encode()
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def stream_template(templates: Jinja2Templates, name: str, context: dict, headers: dict = None) -> StreamingResponse:
+    """同 TemplateResponse，边渲染边发送，渲染在线程池中进行"""
+    if 'request' not in context:
+        raise ValueError('context must include a "request" key')
+    chunks = iter_render(templates.get_template(name), context, chunk_size=settings.template_chunk_size)
+    return StreamingResponse(chunks, media_type='text/html', headers=headers)
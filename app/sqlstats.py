@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+每个请求的 SQL 统计
+
+SQLAlchemy 的 before/after_cursor_execute 事件（异步数据库在 AsyncDatabase 中）记录每条语句的耗时，
+累加到当前请求的 RequestStats 中（contextvars，线程池中运行的同步路由也能拿到）：
+- 响应头 X-DB-Statements / X-DB-Time（毫秒），/metrics 中按路由的语句数和耗时直方图
+- 同一个请求中相同的语句执行了 settings.sql_n_plus_one 次以上时，记录为可能的 N+1 查询，
+  如模板中逐行访问延迟加载的 row.city
+- 超过 settings.sql_slow_ms 的语句记录到慢查询日志，带上路由
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+
+from . import metrics
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+STATEMENTS = metrics.registry.histogram(
+    'db_statements_per_request', '每个请求执行的 SQL 语句数', ('route',),
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, 200))
+DB_TIME = metrics.registry.histogram('db_time_seconds', '每个请求的 SQL 总耗时（秒）', ('route',))
+N_PLUS_ONE = metrics.registry.counter('db_n_plus_one_total', '可能的 N+1 查询次数', ('route',))
+SLOW_QUERIES = metrics.registry.counter('db_slow_queries_total', '慢查询次数', ('route',))
+
+
+class RequestStats(object):
+
+    def __init__(self, scope: dict = None):
+        self.scope = scope
+        self.statements = 0
+        self.seconds = 0.0
+        # 语句 -> 执行次数，ORM 生成的同一种查询参数不同、语句相同
+        self.shapes = {}  # type: Dict[str, int]
+
+    @property
+    def route(self) -> str:
+        return metrics.route_template(self.scope) if self.scope else '-'
+
+    def record(self, statement: str, seconds: float):
+        self.statements += 1
+        self.seconds += seconds
+        self.shapes[statement] = self.shapes.get(statement, 0) + 1
+
+    def repeated(self, threshold: int) -> Dict[str, int]:
+        return {statement: count for statement, count in self.shapes.items() if count >= threshold}
+
+
+_current = ContextVar('sql_stats', default=None)  # type: ContextVar[Optional[RequestStats]]
+
+
+@contextmanager
+def track(scope: dict = None):
+    """在这个上下文中执行的 SQL 记录到返回的 RequestStats 中"""
+    stats = RequestStats(scope)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def record(statement: str, seconds: float):
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, seconds)
+    if seconds * 1000 >= settings.sql_slow_ms:
+        route = stats.route if stats else '-'
+        SLOW_QUERIES.inc(route)
+        logger.warning('slow query %.1fms route=%s: %s', seconds * 1000, route, statement)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._sql_stats_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record(statement, time.perf_counter() - context._sql_stats_start)
+
+
+def finish(stats: RequestStats):
+    """请求结束：写入指标，报告 N+1"""
+    if not stats.statements:
+        return
+    route = stats.route
+    STATEMENTS.labels(route).observe(stats.statements)
+    DB_TIME.labels(route).observe(stats.seconds)
+    for statement, count in stats.repeated(settings.sql_n_plus_one).items():
+        N_PLUS_ONE.inc(route)
+        logger.warning('possible N+1 route=%s: %d x %s', route, count, statement)
+
+
+class SQLStatsMiddleware(object):
+    """纯 ASGI 中间件，响应头中的统计只包含开始发送响应前执行的语句"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        with track(scope) as stats:
+            async def send_wrapper(message):
+                if message['type'] == 'http.response.start':
+                    headers = MutableHeaders(scope=message)
+                    headers['X-DB-Statements'] = str(stats.statements)
+                    headers['X-DB-Time'] = f'{stats.seconds * 1000:.3f}'
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                finish(stats)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+数据同步
+
+数据源格式见 app/data.json，由 feed 模块流式解析，
+每个城市的历史数据整体替换，按批写入 City 和 Data
+"""
+import time
+from datetime import date
+from typing import Iterable, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import crud, feed
+
+
+def location_province(location: dict) -> str:
+    # 国家级数据没有省份，用国家名代替
+    return location.get('province') or location['country']
+
+
+def location_city(location: dict) -> dict:
+    return {
+        'province': location_province(location),
+        'country': location['country'],
+        'country_code': location['country_code'],
+        'country_population': location.get('country_population') or 0,
+    }
+
+
+def sync_rows(db: Session, rows: Iterable[Tuple[dict, date, int, int, int]], chunk_size: int = 5000) -> dict:
+    """rows 为 feed.iter_rows 的输出，写入数据并返回统计信息"""
+    start = time.perf_counter()
+    city_ids = crud.get_city_ids(db)
+    stats = {'locations': 0, 'cities_created': 0}
+
+    def data_rows():
+        current = city_id = None
+        for location, day, confirmed, deaths, recovered in rows:
+            if location is not current:
+                current = location
+                stats['locations'] += 1
+                province = location_province(location)
+                city_id = city_ids.get(province)
+                if city_id is None:
+                    city_id = city_ids[province] = crud.insert_city(db, location_city(location))
+                    stats['cities_created'] += 1
+                else:
+                    crud.delete_city_data(db, city_id)
+
+            yield {
+                'city_id': city_id,
+                'date': day,
+                'confirmed': confirmed,
+                'deaths': deaths,
+                'recovered': recovered,
+            }
+
+    stats['rows'] = crud.bulk_create_data(db, data_rows(), chunk_size=chunk_size)
+    stats['seconds'] = time.perf_counter() - start
+    stats['rows_per_sec'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+
+def sync_locations(db: Session, locations: Iterable[dict], chunk_size: int = 5000) -> dict:
+    return sync_rows(db, feed.rows_from_locations(locations), chunk_size=chunk_size)
+
+
+def sync_file(db: Session, path: str, chunk_size: int = 5000) -> dict:
+    with open(path, 'rb') as f:
+        return sync_rows(db, feed.iter_rows(f), chunk_size=chunk_size)
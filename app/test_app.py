@@ -1,7 +1,27 @@
 # -*- coding: utf-8 -*-
 # pytest 测试用例
+import asyncio
+import gzip
+import io
+import json
+import zlib
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
 from run import app
+from app import assets, async_crud, columnar, compression, crud, downsample, feed, ingest, main, metrics, rendering, sqlstats, sync
+from app.async_database import AsyncDatabase
+from app.database import Base, get_db, make_engine, upgrade_schema, warm_up
+from app.models import City, CityLatest, Data
+from app.schemas import CreateCity, CreateData
 
 # pip install pytest
 client = TestClient(app)
@@ -9,6 +29,559 @@ client = TestClient(app)
 
 # 执行测试 $ pytest
 
+@pytest.fixture
+def db():
+    """内存数据库，每个用例独立"""
+    crud.city_cache.clear()
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine, autoflush=False, autocommit=False)()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
 def test_get_data():
     response = client.post(url='/chapter07/prefix')
     assert response.status_code == 307
+
+
+def test_sync_file(db):
+    stats = sync.sync_file(db, 'app/data.json', chunk_size=100)
+    assert stats['locations'] == 2
+    assert stats['cities_created'] == 2
+    assert stats['rows'] == db.query(Data).count() == 700
+
+    # 重复同步整体替换，不会产生重复数据
+    stats = sync.sync_file(db, 'app/data.json', chunk_size=100)
+    assert stats['cities_created'] == 0
+    assert db.query(City).count() == 2
+    assert db.query(Data).count() == 700
+
+    beijing = crud.get_city_by_name(db, 'Beijing')
+    latest = db.query(Data).filter(Data.city_id == beijing.id).first()
+    assert (latest.confirmed, latest.deaths) == (994, 9)
+
+
+def test_feed_iter_rows():
+    with open('app/data.json', encoding='utf-8') as f:
+        locations = json.load(f)['locations']
+    expected = [
+        (location['province'], day, confirmed, deaths, recovered)
+        for location in locations
+        for day, confirmed, deaths, recovered in feed.location_rows(location['timelines'])
+    ]
+
+    # 很小的块，覆盖值被块边界截断的情况
+    with open('app/data.json', 'rb') as f:
+        rows = [(location['province'], *row) for location, *row in feed.iter_rows(f, chunk_size=7)]
+    assert rows == expected
+    assert len(rows) == 700
+
+    assert list(feed.iter_rows(io.StringIO('{"latest": {}, "locations": []}'))) == []
+
+
+def test_get_data_loads_city(db):
+    sync.sync_file(db, 'app/data.json')
+
+    statements = []
+    event.listen(db.bind, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    for city in (None, 'Shanghai'):
+        statements.clear()
+        data = crud.get_data(db, city=city, skip=5, limit=20)
+        assert isinstance(data, list)
+        assert len(data) == 20
+        if city:
+            assert {row.city.province for row in data} == {city}
+        else:
+            assert all(row.city.province for row in data)
+        assert len(statements) == 1
+
+
+def test_get_data_cursor(db):
+    sync.sync_file(db, 'app/data.json')
+
+    for city in (None, 'Beijing'):
+        expected = crud.get_data(db, city=city, limit=1000)
+        rows, after = [], None
+        while True:
+            page = crud.get_data(db, city=city, limit=64, after=after)
+            rows.extend(page)
+            after = crud.next_cursor(page, 64, crud.data_cursor)
+            if not after:
+                break
+        assert [row.id for row in rows] == [row.id for row in expected]
+
+    # skip/limit 依旧可用
+    assert crud.get_data(db, city='Beijing', skip=10, limit=5) == expected[10:15]
+
+    with pytest.raises(ValueError):
+        crud.get_data(db, after='not-a-cursor')
+
+
+def test_get_cities_cursor(db):
+    sync.sync_file(db, 'app/data.json')
+    first = crud.get_cities(db, limit=1)
+    second = crud.get_cities(db, limit=1, after=crud.city_cursor(first[0]))
+    assert [city.province for city in first + second] == ['Beijing', 'Shanghai']
+    assert crud.get_cities(db, limit=1, after=crud.city_cursor(second[0])) == []
+
+
+def test_upgrade_schema(db):
+    # 模拟没有新索引的旧数据库
+    db.execute('DROP INDEX ix_data_date')
+    db.execute('DROP INDEX ix_data_city_id_date_covering')
+    upgrade_schema(bind=db.bind)
+    names = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'ix_data_date', 'ix_data_city_id_date_covering', 'ix_city_country_code'} <= names
+
+
+def test_async_crud_matches_sync(tmp_path):
+    url = f'sqlite:///{tmp_path}/async.sqlite'
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    sync.sync_file(db, 'app/data.json')
+
+    async def fetch():
+        database = AsyncDatabase(url, pool_size=2)
+        await database.connect()
+        try:
+            return (
+                await async_crud.get_data(database, city='Shanghai', limit=30),
+                await async_crud.get_cities(database, limit=1, after=crud.encode_cursor('CN', 1)),
+            )
+        finally:
+            await database.disconnect()
+
+    data, cities = asyncio.run(fetch())
+    expected = crud.get_data(db, city='Shanghai', limit=30)
+    assert [(row.id, row.date, row.city.province) for row in data] == \
+           [(row.id, row.date, row.city.province) for row in expected]
+    assert [city.province for city in cities] == ['Shanghai']
+    db.close()
+
+
+def test_city_cache(db):
+    sync.sync_file(db, 'app/data.json')
+    statements = []
+    event.listen(db.bind, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    hits = crud.city_cache.hits
+    assert crud.get_city_info(db, 'Beijing').province == 'Beijing'
+    assert crud.get_city_info(db, 'Beijing').province == 'Beijing'
+    assert len(statements) == 1
+    assert crud.city_cache.hits == hits + 1
+
+    # 不存在的城市不缓存，新建后可以查到
+    assert crud.get_city_info(db, 'Hubei') is None
+    crud.create_city(db, CreateCity(province='Hubei', country='China', country_code='CN', country_population='1'))
+    assert crud.get_city_info(db, 'Hubei').country == 'China'
+
+    crud.city_cache.enabled = False
+    try:
+        statements.clear()
+        crud.get_city_info(db, 'Beijing')
+        crud.get_city_info(db, 'Beijing')
+        assert len(statements) == 2
+    finally:
+        crud.city_cache.enabled = True
+
+
+def test_get_data_not_modified(db):
+    sync.sync_file(db, 'app/data.json')
+    app.dependency_overrides[get_db] = lambda: db
+    try:
+        url = '/chapter07/get_data?city=Beijing&limit=5'
+        response = client.get(url)
+        assert response.status_code == 200
+        etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.content == b''
+        assert client.get(url, headers={'If-Modified-Since': last_modified}).status_code == 304
+        # 不同的查询参数是不同的资源
+        assert client.get(url + '&skip=5', headers={'If-None-Match': etag}).status_code == 200
+
+        beijing = crud.get_city_info(db, 'Beijing')
+        crud.create_city_data(db, CreateData(date='2021-01-06', confirmed=1000), city_id=beijing.id)
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_lttb():
+    x = np.arange(1000)
+    ys = np.stack([np.sin(x / 50) * 100, x * 2.0], axis=1)
+    ys[500, 0] = 1000  # 峰值必须保留
+    indices = downsample.lttb(x, ys, 50)
+    assert indices.shape == (50, 2)
+    assert (indices[0] == 0).all() and (indices[-1] == 999).all()
+    assert (np.diff(indices, axis=0) > 0).all()
+    assert 500 in indices[:, 0]
+    # 点数不足时原样返回
+    assert downsample.lttb(x[:10], ys[:10], 50).shape == (10, 2)
+
+
+def test_timeline(db):
+    sync.sync_file(db, 'app/data.json')
+    app.dependency_overrides[get_db] = lambda: db
+    try:
+        response = client.get('/chapter07/timeline', params={'city': 'Beijing', 'points': 40, 'start': '2020-02-01'})
+        assert response.status_code == 200
+        result = response.json()
+        assert result['total'] == 340
+        assert result['points'] == 40
+        confirmed = result['series']['confirmed']
+        assert confirmed['date'][0] == '2020-02-01' and confirmed['date'][-1] == '2021-01-05'
+        assert confirmed['value'][-1] == 994
+        assert client.get('/chapter07/timeline', params={'city': 'Nowhere'}).status_code == 400
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_city_latest(db):
+    sync.sync_file(db, 'app/data.json')
+
+    def latest():
+        return {row.city_id: (row.date, row.confirmed, row.deaths) for row in db.query(CityLatest)}
+
+    expected = {
+        city_id: (row.date, row.confirmed, row.deaths)
+        for city_id, row in ((city.id, crud.get_data(db, city=city.province, limit=1)[0]) for city in db.query(City))
+    }
+    assert latest() == expected
+
+    # 从 Data 重建的结果相同
+    db.query(CityLatest).delete()
+    db.commit()
+    assert crud.backfill_city_latest(db)
+    assert latest() == expected
+    assert not crud.backfill_city_latest(db)
+
+    # 较早的数据不覆盖，同一天和更新的数据覆盖
+    beijing = crud.get_city_info(db, 'Beijing')
+    crud.create_city_data(db, CreateData(date='2020-06-01', confirmed=1), city_id=beijing.id)
+    assert latest()[beijing.id] == expected[beijing.id]
+    crud.create_city_data(db, CreateData(date='2021-01-06', confirmed=1000, deaths=10), city_id=beijing.id)
+    assert latest()[beijing.id][1:] == (1000, 10)
+
+    app.dependency_overrides[get_db] = lambda: db
+    try:
+        result = client.get('/chapter07/latest', params={'country_code': 'CN'}).json()
+        assert result['date'] == '2021-01-06'
+        assert result['latest']['confirmed'] == sum(row[1] for row in latest().values())
+        assert client.get('/chapter07/latest', params={'country_code': 'XX'}).json()['cities'] == 0
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_ingest(db):
+    sync.sync_file(db, 'app/data.json')
+    total = db.query(Data).count()
+    lines = [
+        json.dumps({'city': 'Beijing', 'date': '2021-01-06', 'confirmed': 1000}),
+        '',
+        json.dumps({'date': '2021-01-07', 'confirmed': 1001}),
+        json.dumps({'city': 'Nowhere', 'date': '2021-01-06'}),
+        json.dumps({'city': 'Beijing', 'date': 'not a date'}),
+        '{"city": "Beijing", "date": "2021-01-08", "confirmed": ' + ' ' * 200 + '1}',
+        json.dumps({'city': 'Beijing', 'date': '2021-01-09', 'confirmed': 1003}),
+    ]
+    body = '\n'.join(lines).encode()
+
+    async def stream():
+        # 块边界落在行中间
+        for i in range(0, len(body), 7):
+            yield body[i:i + 7]
+
+    result = asyncio.run(ingest.ingest_stream(db, stream(), city='Beijing', batch_size=2, max_line=100))
+    assert (result['lines'], result['accepted'], result['rejected']) == (7, 3, 3)
+    assert [(batch['accepted'], batch['rejected']) for batch in result['batches']] == [(2, 0), (0, 2), (1, 1)]
+    assert [error['line'] for batch in result['batches'] for error in batch['errors']] == [4, 5, 6]
+    assert db.query(Data).count() == total + 3
+    assert db.query(CityLatest).filter(CityLatest.city_id == 1).one().confirmed == 1003
+
+    app.dependency_overrides[get_db] = lambda: db
+    try:
+        response = client.post('/chapter07/ingestData?city=Beijing', data=body)
+        assert response.status_code == 200
+        # 默认的单行上限足够，只有格式错误的两行被拒绝
+        assert (response.json()['accepted'], response.json()['rejected']) == (4, 2)
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_export(db):
+    sync.sync_file(db, 'app/data.json')
+    chunks = list(crud.iter_export(db, chunk_size=300))
+    assert [len(rows) for rows in chunks] == [300, 300, 100]
+
+    app.dependency_overrides[get_db] = lambda: db
+    try:
+        response = client.get('/chapter07/export', params={'city': 'Beijing'})
+        assert response.headers['content-type'] == 'application/x-ndjson'
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert len(rows) == 350
+        assert rows[-1]['province'] == 'Beijing' and rows[-1]['date'] == '2021-01-05'
+        assert rows[-1]['confirmed'] == 994
+
+        response = client.get('/chapter07/export', params={'format': 'csv'})
+        lines = response.text.splitlines()
+        assert lines[0] == 'id,city_id,province,date,confirmed,deaths,recovered,updated_at'
+        assert len(lines) == 701
+        assert client.get('/chapter07/export', params={'format': 'xml'}).status_code == 422
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_columnar(db):
+    sync.sync_file(db, 'app/data.json')
+    assert columnar.negotiate(None, ('a', 'b')) == 'a'
+    assert columnar.negotiate('b;q=0.5, a;q=0.9', ('a', 'b')) == 'a'
+    assert columnar.negotiate('text/html, b', ('a', 'b')) == 'b'
+
+    app.dependency_overrides[get_db] = lambda: db
+    try:
+        url = '/chapter07/get_data?city=Beijing&limit=50'
+        rows = client.get(url).json()
+
+        response = client.get(url, headers={'Accept': columnar.COLUMNAR_JSON})
+        assert response.headers['content-type'].startswith(columnar.COLUMNAR_JSON)
+        assert response.headers['Vary'] == 'Accept'
+        assert response.headers['X-Next-Cursor']
+        result = response.json()
+        assert result['count'] == 50
+        assert result['cities'] == {'1': 'Beijing'}
+        assert result['columns']['confirmed'] == [row['confirmed'] for row in rows]
+        base = date.fromisoformat(result['bases']['date'])
+        assert [(base + timedelta(days=offset)).isoformat() for offset in result['columns']['date']] == [
+            row['date'] for row in rows]
+
+        binary = client.get(url, headers={'Accept': columnar.COLUMNAR_BINARY})
+        decoded = columnar.decode_binary(binary.content)
+        assert decoded['columns']['id'].tolist() == [row['id'] for row in rows]
+        assert decoded['columns']['date'].dtype.itemsize == 1
+        assert decoded['columns']['date'].tolist() == result['columns']['date']
+        assert len(binary.content) * 3 < len(json.dumps(rows))
+
+        # 不同格式的 ETag 不同
+        assert binary.headers['ETag'] != response.headers['ETag']
+        assert client.get(url, headers={'Accept': columnar.COLUMNAR_BINARY, 'If-None-Match': binary.headers['ETag']}).status_code == 304
+        assert client.get(url, headers={'If-None-Match': binary.headers['ETag']}).status_code == 200
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_engine_profiles(tmp_path):
+    engine = make_engine(f'sqlite:///{tmp_path}/prod.sqlite', profile='prod')
+    try:
+        assert not engine.echo
+        Base.metadata.create_all(bind=engine)
+        warm_up(engine)
+        assert engine.pool.checkedin() == engine.pool.size()
+        pragmas = {name: engine.execute(f'PRAGMA {name}').scalar() for name in ('journal_mode', 'synchronous', 'busy_timeout')}
+        assert pragmas == {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000}
+    finally:
+        engine.dispose()
+
+    engine = make_engine(f'sqlite:///{tmp_path}/dev.sqlite', profile='dev')
+    assert engine.echo
+    assert engine.execute('PRAGMA journal_mode').scalar() == 'delete'
+    engine.dispose()
+
+
+def test_metrics():
+    histogram = metrics.Histogram(buckets=(0.01, 0.1, 1.0))
+    for value in (0.005, 0.05, 0.05, 0.5):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 0]
+    assert histogram.quantile(0.5) == pytest.approx(0.055)
+
+    for message in ('a', 'b'):
+        client.get(f'/chapter03/path/{message}')
+    client.get('/no/such/path')
+
+    text = client.get('/metrics').text
+    assert 'route="/chapter03/path/{message}",method="GET",status="200",le="+Inf"} ' in text
+    assert 'route="unmatched",method="GET",status="404"' in text
+    assert 'http_requests_in_flight 1' in text
+    assert 'threadpool_size ' in text
+
+    rows = [row for row in client.get('/metrics', params={'format': 'json'}).json()
+            if row['route'] == '/chapter03/path/{message}']
+    assert rows[0]['count'] >= 2 and rows[0]['p99_ms'] > 0
+
+
+def test_sqlstats(db, caplog):
+    sync.sync_file(db, 'app/data.json')
+    with sqlstats.track() as stats:
+        for data_id in range(1, 8):
+            db.query(Data).filter(Data.id == data_id).first()
+        crud.get_data(db, limit=20)
+    assert stats.statements == 8
+    assert list(stats.repeated(5).values()) == [7]
+
+    with caplog.at_level('WARNING', logger='app.sqlstats'):
+        sqlstats.finish(stats)
+    assert 'possible N+1' in caplog.text
+
+    app.dependency_overrides[get_db] = lambda: db
+    try:
+        response = client.get('/chapter07/get_data', params={'city': 'Beijing'})
+        # 版本 + 城市（缓存未命中）+ 数据
+        assert response.headers['X-DB-Statements'] == '3'
+        assert float(response.headers['X-DB-Time']) > 0
+        assert 'db_statements_per_request_count{route="/chapter07/get_data"}' in client.get('/metrics').text
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_index_streaming(db):
+    sync.sync_file(db, 'app/data.json')
+    app.dependency_overrides[get_db] = lambda: db
+    try:
+        response = client.get('/chapter07/', params={'city': 'Beijing', 'limit': 10})
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/html')
+        assert response.text.count('<td>Beijing</td>') == 10
+        assert '下一页' in response.text
+        assert 'X-DB-Statements' in response.headers
+
+        response = client.get('/chapter07/', params={'city': 'Beijing', 'limit': 1000})
+        assert response.text.count('<td>Beijing</td>') == 350
+        assert '下一页' not in response.text
+    finally:
+        app.dependency_overrides.clear()
+
+    # 按块输出，和一次渲染的结果相同
+    template = main.templates.get_template('home.html')
+    context = {'request': None, 'data': crud.get_data(db, limit=700), 'url_for': lambda *args, **kwargs: ''}
+    chunks = list(rendering.iter_render(template, context, chunk_size=4096))
+    assert len(chunks) > 10
+    assert b''.join(chunks).decode() == template.render(context)
+
+
+def test_assets(tmp_path):
+    static = tmp_path / 'static'
+    (static / 'fonts').mkdir(parents=True)
+    (static / 'templates').mkdir()
+    (static / 'fonts' / 'icons.woff').write_bytes(b'woff' * 100)
+    (static / 'app.js').write_text('console.log("hello");\n' * 200)
+    (static / 'site.css').write_text(
+        '@font-face { src: url("fonts/icons.woff?v=1#x"), url(data:font/woff;base64,AAAA); }\n' * 50)
+    (static / 'templates' / 'page.html').write_text("<script src=\"{{ url_for('static', path='/app.js') }}\"></script>")
+
+    manifest = assets.build(str(static))
+    font = manifest['files']['fonts/icons.woff']
+    assert font.startswith('fonts/icons.') and font.endswith('.woff')
+    # 已经压缩的格式不再压缩
+    assert manifest['encodings'][font] == []
+    assert set(manifest['encodings'][manifest['files']['app.js']]) == {'gzip', 'br'}
+    css = (static / 'dist' / manifest['files']['site.css']).read_text()
+    assert f'url("{font}?v=1#x")' in css
+    assert 'url(data:font/woff;base64,AAAA)' in css
+    # 内容不变时文件名不变
+    assert assets.build(str(static))['files'] == manifest['files']
+
+    test_app = FastAPI()
+    test_app.mount('/static', assets.AssetFiles(directory=str(static)), name='static')
+    templates = rendering.make_templates(str(static / 'templates'), static_directory=str(static))
+
+    @test_app.get('/page')
+    def page(request: Request):
+        return templates.TemplateResponse('page.html', {'request': request})
+
+    test_client = TestClient(test_app)
+    url = f'/static/dist/{manifest["files"]["app.js"]}'
+    assert url in test_client.get('/page').text
+
+    for accept, encoding in [('gzip, br', 'br'), ('gzip', 'gzip'), ('br;q=0, gzip', 'gzip'), ('identity', None)]:
+        response = test_client.get(url, headers={'Accept-Encoding': accept})
+        assert response.status_code == 200
+        assert response.headers.get('content-encoding') == encoding
+        assert response.headers['cache-control'] == assets.IMMUTABLE
+        assert response.text == (static / 'app.js').read_text()
+
+    # 原文件仍然可以访问
+    response = test_client.get('/static/app.js')
+    assert response.status_code == 200
+    assert 'immutable' not in response.headers.get('cache-control', '')
+
+
+def test_compression():
+    test_app = FastAPI()
+    test_app.add_middleware(compression.CompressionMiddleware, minimum_size=500)
+    rows = [{'id': i, 'city': 'Beijing', 'confirmed': i * 10} for i in range(200)]
+
+    @test_app.get('/small')
+    def small():
+        return {'ok': True}
+
+    @test_app.get('/large')
+    def large():
+        return rows
+
+    @test_app.get('/png')
+    def png():
+        return Response(b'\x89PNG' * 1000, media_type='image/png')
+
+    @test_app.get('/encoded')
+    def encoded():
+        return Response(gzip.compress(b'x' * 1000), media_type='text/plain', headers={'Content-Encoding': 'gzip'})
+
+    @test_app.get('/stream')
+    def stream():
+        return StreamingResponse((f'{i}\n' * 100 for i in range(10)), media_type='text/plain')
+
+    test_client = TestClient(test_app)
+    response = test_client.get('/large', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert int(response.headers['content-length']) < len(json.dumps(rows)) / 4
+    assert 'Accept-Encoding' in response.headers['vary']
+    assert response.json() == rows
+
+    response = test_client.get('/large', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['content-encoding'] == 'br'
+    assert response.json() == rows
+
+    response = test_client.get('/large', headers={'Accept-Encoding': 'identity'})
+    assert 'content-encoding' not in response.headers
+
+    for path in ('/small', '/png'):
+        response = test_client.get(path, headers={'Accept-Encoding': 'gzip'})
+        assert 'content-encoding' not in response.headers
+
+    # 已经压缩的响应原样返回
+    response = test_client.get('/encoded', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.text == 'x' * 1000
+
+    # 流式响应逐块压缩，每一块都可以马上解压
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': '/stream', 'raw_path': b'/stream', 'root_path': '',
+        'scheme': 'http', 'query_string': b'', 'headers': [(b'accept-encoding', b'gzip')],
+        'server': ('testserver', 80), 'client': ('testclient', 50000), 'http_version': '1.1',
+    }
+    asyncio.run(test_app(scope, receive, send))
+    headers = dict(messages[0]['headers'])
+    assert headers[b'content-encoding'] == b'gzip'
+    assert b'content-length' not in headers
+    bodies = [message['body'] for message in messages[1:] if message['body']]
+    assert len(bodies) >= 10
+    decompressor = zlib.decompressobj(31)
+    for i, body in enumerate(bodies[:10]):
+        assert decompressor.decompress(body) == f'{i}\n'.encode() * 100
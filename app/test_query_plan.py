@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# crud 查询计划回归测试：每条查询都要走索引，不能全表扫描或使用临时B树排序
+import inspect
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import crud, sync
+from app.database import Base
+from app.schemas import CreateCity, CreateData
+
+# 不访问数据库的辅助函数
+HELPERS = {
+    'encode_cursor', 'decode_cursor', 'city_cursor', 'data_cursor', 'next_cursor',
+    'city_after_clause', 'data_after_clause', 'mark_written', 'data_version_query', 'data_version', 'latest_rows',
+}
+
+# 汇总表每个城市只有一行，全表汇总是预期的
+SUMMARY_TABLES = {'city_latest'}
+
+# crud 函数 -> 调用方式，新增 crud 查询时需要在这里补充
+SCENARIOS = {
+    'get_city': lambda db: crud.get_city(db, city_id=1),
+    'get_city_by_name': lambda db: crud.get_city_by_name(db, city_name='Beijing'),
+    'get_city_info': lambda db: (crud.city_cache.clear(), crud.get_city_info(db, city_name='Beijing')),
+    'get_cities': lambda db: crud.get_cities(db, skip=1, limit=10),
+    'get_cities#after': lambda db: crud.get_cities(db, limit=10, after=crud.encode_cursor('CN', 1)),
+    'create_city': lambda db: crud.create_city(db, CreateCity(
+        province='Hubei', country='China', country_code='CN', country_population='1392730000')),
+    'get_data': lambda db: crud.get_data(db, skip=10, limit=10),
+    'get_data#after': lambda db: crud.get_data(db, limit=10, after=crud.encode_cursor('2020-06-01', 100)),
+    'get_data#city': lambda db: crud.get_data(db, city='Beijing', skip=10, limit=10),
+    'get_data#city_after': lambda db: crud.get_data(
+        db, city='Beijing', limit=10, after=crud.encode_cursor('2020-06-01', 100)),
+    'get_data_version': lambda db: crud.get_data_version(db),
+    'get_data_version#city': lambda db: crud.get_data_version(db, city='Beijing'),
+    'get_timeline': lambda db: crud.get_timeline(
+        db, city_id=1, start=sync.feed.parse_date('2020-03-01'), end=sync.feed.parse_date('2020-09-01')),
+    'create_city_data': lambda db: crud.create_city_data(db, CreateData(date='2021-01-06', confirmed=1), city_id=1),
+    'upsert_city_latest': lambda db: crud.upsert_city_latest(db, [
+        {'city_id': 1, 'date': sync.feed.parse_date('2021-01-08'), 'confirmed': 1}]),
+    'backfill_city_latest': lambda db: crud.backfill_city_latest(db),
+    'get_latest': lambda db: crud.get_latest(db),
+    'get_latest#country': lambda db: crud.get_latest(db, country_code='CN'),
+    'iter_export': lambda db: list(crud.iter_export(db, chunk_size=100)),
+    'iter_export#city': lambda db: list(crud.iter_export(db, city_id=1, chunk_size=100)),
+    'get_city_ids': lambda db: crud.get_city_ids(db),
+    'insert_city': lambda db: crud.insert_city(db, {
+        'province': 'Hebei', 'country': 'China', 'country_code': 'CN', 'country_population': 1}),
+    'delete_city_data': lambda db: crud.delete_city_data(db, city_id=2),
+    'bulk_create_data': lambda db: crud.bulk_create_data(db, [
+        {'city_id': 1, 'date': sync.feed.parse_date('2021-01-07'), 'confirmed': 1, 'deaths': 0, 'recovered': 0}]),
+}
+
+
+@pytest.fixture(scope='module')
+def engine():
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    sync.sync_file(db, 'app/data.json')
+    db.close()
+    return engine
+
+
+def query_plan(engine, statement, parameters):
+    if isinstance(parameters, list):
+        # executemany
+        parameters = parameters[0]
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+
+def bad_steps(plan):
+    """全表扫描或临时B树排序"""
+    return [
+        step for step in plan
+        if 'TEMP B-TREE' in step or (
+            step.startswith('SCAN') and 'INDEX' not in step and 'CONSTANT ROW' not in step
+            and step.split()[1] not in SUMMARY_TABLES
+        )
+    ]
+
+
+def test_scenarios_cover_crud():
+    functions = {
+        name for name, func in inspect.getmembers(crud, inspect.isfunction)
+        if func.__module__ == crud.__name__ and not name.startswith('_')
+    }
+    covered = {name.split('#')[0] for name in SCENARIOS}
+    assert functions - HELPERS == covered
+
+
+@pytest.mark.parametrize('name', sorted(SCENARIOS))
+def test_query_plan(engine, name):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    db = sessionmaker(bind=engine)()
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        SCENARIOS[name](db)
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        db.rollback()
+        db.close()
+
+    assert statements
+    for statement, parameters in statements:
+        if statement.lstrip().upper().startswith('INSERT'):
+            continue
+        plan = query_plan(engine, statement, parameters)
+        assert not bad_steps(plan), (statement, plan)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+进程内直接调用 ASGI 应用，不经过网络，用于压测
+"""
+import asyncio
+import json
+import time
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
+
+
+class Response(object):
+
+    def __init__(self):
+        self.status = 0
+        self.headers = {}
+        self.body = b''
+
+    def json(self):
+        return json.loads(self.body)
+
+
+async def request(app, method: str, url: str, headers: Optional[List[Tuple[str, str]]] = None,
+                  body: bytes = b'') -> Response:
+    parts = urlsplit(url)
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method.upper(),
+        'scheme': 'http',
+        'path': parts.path,
+        'raw_path': parts.path.encode(),
+        'query_string': parts.query.encode(),
+        'root_path': '',
+        'headers': [(b'host', b'bench')] + [
+            (key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in headers or []
+        ],
+        'client': ('127.0.0.1', 0),
+        'server': ('bench', 80),
+    }
+    sent = False
+    response = Response()
+    chunks = []
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            # 请求体已经发送完，等待断开
+            await asyncio.sleep(3600)
+            return {'type': 'http.disconnect'}
+        sent = True
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response.status = message['status']
+            response.headers = {
+                key.decode('latin-1'): value.decode('latin-1') for key, value in message.get('headers', [])
+            }
+        elif message['type'] == 'http.response.body':
+            chunks.append(message.get('body', b''))
+
+    await app(scope, receive, send)
+    response.body = b''.join(chunks)
+    return response
+
+
+async def lifespan(app, event: str):
+    """startup / shutdown"""
+    await getattr(app.router, event)()
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+async def run_load(app, make_request, concurrency: int, requests: int) -> dict:
+    """
+    concurrency 个协程并发发送共 requests 个请求
+    make_request(i) 返回 (method, url, headers, body)
+    """
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            method, url, headers, body = make_request(i)
+            start = time.perf_counter()
+            response = await request(app, method, url, headers=headers, body=body)
+            latencies.append(time.perf_counter() - start)
+            if response.status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': errors,
+        'seconds': round(elapsed, 4),
+        'rps': round(requests / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
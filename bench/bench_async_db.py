@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+第七章路由在同步（线程池 + Session）和异步（aiosqlite）两种模式下的吞吐对比
+
+    $ python -m bench.bench_async_db --concurrency 1 16 64 --requests 2000
+
+每种模式在单独的子进程中运行，配置通过环境变量 APP_ASYNC_DB / APP_DATABASE_URL 传入
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from .seed import seed_database
+
+MODES = ('sync', 'async')
+
+
+def make_request_factory(scenario: str, cities: int):
+    def make_request(i):
+        city = f'p{i % cities}'
+        if scenario == 'write':
+            body = json.dumps({'date': '2021-06-01', 'confirmed': i}).encode()
+            return 'POST', f'/chapter07/createData?city={city}', [('content-type', 'application/json')], body
+        kind = i % 3
+        if kind == 0:
+            return 'GET', f'/chapter07/get_data?city={city}&limit=20', None, b''
+        if kind == 1:
+            return 'GET', f'/chapter07/getCity/{city}', None, b''
+        return 'POST', '/chapter07/getCites?limit=20', None, b''
+
+    return make_request
+
+
+def run_scenarios(args) -> list:
+    """导入应用，依次压测各个场景和并发数"""
+    from run import app
+    from .asgi import lifespan, run_load
+
+    async def main():
+        await lifespan(app, 'startup')
+        try:
+            results = []
+            for scenario in args.scenarios:
+                make_request = make_request_factory(scenario, args.cities)
+                # 预热
+                await run_load(app, make_request, concurrency=4, requests=50)
+                for concurrency in args.concurrency:
+                    result = await run_load(app, make_request, concurrency=concurrency, requests=args.requests)
+                    result['scenario'] = scenario
+                    results.append(result)
+            return results
+        finally:
+            await lifespan(app, 'shutdown')
+
+    return asyncio.run(main())
+
+
+def worker(args):
+    """子进程：导入应用并压测，结果以 JSON 输出到 stdout"""
+    from app.database import engine
+
+    # 不打印 SQL，避免日志影响结果
+    engine.echo = False
+    print(json.dumps(run_scenarios(args)))
+
+
+def run_mode(mode: str, database_path: str, args) -> list:
+    env = dict(os.environ, APP_ASYNC_DB='1' if mode == 'async' else '0', APP_DATABASE_URL=f'sqlite:///{database_path}')
+    command = [sys.executable, '-m', 'bench.bench_async_db', '--worker',
+               '--requests', str(args.requests), '--cities', str(args.cities),
+               '--concurrency', *map(str, args.concurrency), '--scenarios', *args.scenarios]
+    output = subprocess.run(command, env=env, check=True, stdout=subprocess.PIPE).stdout
+    # 最后一行是结果
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--cities', type=int, default=50)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--scenarios', nargs='+', choices=['read', 'write'], default=['read', 'write'])
+    parser.add_argument('--json', help='结果写入文件')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args)
+
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in MODES:
+            # 每种模式使用全新的数据库，写入互不影响
+            path = os.path.join(directory, f'{mode}.sqlite')
+            seed_database(path, cities=args.cities, days=args.days)
+            report[mode] = run_mode(mode, path, args)
+
+    print(f"{'scenario':<8} {'concurrency':>11} " + ' '.join(f'{mode + " rps":>10} {mode + " p99":>10}' for mode in MODES))
+    for rows in zip(*(report[mode] for mode in MODES)):
+        print(f'{rows[0]["scenario"]:<8} {rows[0]["concurrency"]:>11} ' + ' '.join(
+            f'{row["rps"]:>10} {row["p99_ms"]:>8}ms' for row in rows))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
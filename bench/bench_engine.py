@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+数据库引擎 profile（dev / prod，见 app.database.PROFILES）的读写吞吐对比
+
+    $ python -m bench.bench_engine --concurrency 1 16 --requests 2000
+
+每个 profile 在单独的子进程中运行，配置通过环境变量 APP_DB_PROFILE / APP_DATABASE_URL 传入；
+dev 保留 echo，结果包含打印 SQL 的开销
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from .bench_async_db import run_scenarios
+from .seed import seed_database
+
+PROFILES = ('dev', 'prod')
+
+
+def worker(args):
+    """子进程：压测结果以 JSON 输出到 stdout 的最后一行"""
+    print(json.dumps(run_scenarios(args)))
+
+
+def run_profile(profile: str, database_path: str, args) -> list:
+    env = dict(os.environ, APP_DB_PROFILE=profile, APP_DATABASE_URL=f'sqlite:///{database_path}')
+    command = [sys.executable, '-m', 'bench.bench_engine', '--worker',
+               '--requests', str(args.requests), '--cities', str(args.cities),
+               '--concurrency', *map(str, args.concurrency), '--scenarios', *args.scenarios]
+    # dev 打印的 SQL 也在 stdout 中，结果是最后一行
+    output = subprocess.run(command, env=env, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=list(PROFILES))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--cities', type=int, default=50)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--scenarios', nargs='+', choices=['read', 'write'], default=['read', 'write'])
+    parser.add_argument('--json', help='结果写入文件')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args)
+
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in args.profiles:
+            # 每个 profile 使用全新的数据库，WAL 会持久地改变数据库文件
+            path = os.path.join(directory, f'{profile}.sqlite')
+            seed_database(path, cities=args.cities, days=args.days)
+            report[profile] = run_profile(profile, path, args)
+
+    print(f"{'scenario':<8} {'concurrency':>11} " + ' '.join(
+        f'{profile + " rps":>10} {profile + " p99":>10}' for profile in args.profiles))
+    for rows in zip(*(report[profile] for profile in args.profiles)):
+        print(f'{rows[0]["scenario"]:<8} {rows[0]["concurrency"]:>11} ' + ' '.join(
+            f'{row["rps"]:>10} {row["p99_ms"]:>8}ms' for row in rows))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+生成压测用的 SQLite 数据库
+"""
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import sync
+from app.database import Base, upgrade_schema
+
+
+def make_locations(cities: int, days: int, start: date = date(2020, 1, 22)):
+    """和 app/data.json 格式相同的 location，城市名为 p0, p1, ..."""
+    keys = [(start + timedelta(days=i)).isoformat() + 'T00:00:00Z' for i in range(days)]
+    for n in range(cities):
+        yield {
+            'country': f'Country{n % 10}',
+            'country_code': f'C{n % 10}',
+            'country_population': 1000000,
+            'province': f'p{n}',
+            'last_updated': start.isoformat() + 'T00:00:00Z',
+            'timelines': {
+                'confirmed': {'timeline': {key: i * 10 + n for i, key in enumerate(keys)}},
+                'deaths': {'timeline': {key: i for i, key in enumerate(keys)}},
+                'recovered': {'timeline': {key: i * 5 for i, key in enumerate(keys)}},
+            },
+        }
+
+
+def seed_database(path: str, cities: int = 50, days: int = 365) -> dict:
+    engine = create_engine(f'sqlite:///{path}')
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(bind=engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        return sync.sync_locations(db, make_locations(cities, days))
+    finally:
+        db.close()
+        engine.dispose()
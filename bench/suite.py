@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+run.app 全部路由的压测
+
+    $ python -m bench.suite --json result.json                      # 运行并保存结果
+    $ python -m bench.suite --save-baseline bench/baseline.json     # 保存基线
+    $ python -m bench.suite --baseline bench/baseline.json          # 和基线比较，退化时退出码为 1
+
+进程内直接调用 ASGI 应用，不经过网络；每次运行使用新生成的 SQLite 数据库，结果可以复现
+第八章的任务会 sleep 10 秒，不在压测范围内
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import uuid
+
+from .asgi import lifespan, request, run_load
+from .seed import seed_database
+
+JSON = [('content-type', 'application/json')]
+
+
+def multipart(field: str, filename: str, content: bytes):
+    """multipart/form-data 请求体，返回 (headers, body)"""
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\n'.encode(),
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'.encode(),
+        b'Content-Type: application/octet-stream\r\n\r\n',
+        content,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+    return [('content-type', f'multipart/form-data; boundary={boundary}')], body
+
+
+def form(**fields):
+    body = '&'.join(f'{key}={value}' for key, value in fields.items()).encode()
+    return [('content-type', 'application/x-www-form-urlencoded')], body
+
+
+async def login(app) -> str:
+    headers, body = form(username='user1', password='123456')
+    response = await request(app, 'POST', '/chapter06/jwt/token', headers=headers, body=body)
+    return response.json()['access_token']
+
+
+def make_scenarios(cities: int, token: str, upload_size: int) -> dict:
+    """
+    场景名 -> (make_request, 请求数的倍数)
+    make_request(i) 返回 (method, url, headers, body)
+    """
+    upload_headers, upload_body = multipart('file', 'data.bin', os.urandom(upload_size))
+    login_headers, login_body = form(username='user1', password='123456')
+    city_body = json.dumps({'name': 'Beijing', 'country': 'China', 'country_code': 'CN',
+                            'country_population': 1400000000}).encode()
+    auth = [('authorization', f'Bearer {token}')]
+
+    def chapter07_read(i):
+        city = f'p{i % cities}'
+        kind = i % 3
+        if kind == 0:
+            return 'GET', f'/chapter07/get_data?city={city}&limit=20', None, b''
+        if kind == 1:
+            return 'GET', f'/chapter07/getCity/{city}', None, b''
+        return 'POST', '/chapter07/getCites?limit=20', None, b''
+
+    def chapter07_write(i):
+        body = json.dumps({'date': '2021-06-01', 'confirmed': i}).encode()
+        return 'POST', f'/chapter07/createData?city=p{i % cities}', JSON, body
+
+    return {
+        'chapter03.path': (lambda i: ('GET', f'/chapter03/path/m{i}', None, b''), 1),
+        'chapter03.query': (lambda i: ('GET', f'/chapter03/query?page={i}&size=20', None, b''), 1),
+        'chapter03.body': (lambda i: ('POST', '/chapter03/body/city', JSON, city_body), 1),
+        'chapter04.form': (lambda i: ('POST', '/chapter04/form', *form(username=f'u{i}', password='p')), 1),
+        'chapter04.file': (lambda i: ('POST', '/chapter04/file', upload_headers, upload_body), 1),
+        'chapter04.upload_file': (lambda i: ('POST', '/chapter04/upload_file', upload_headers, upload_body), 1),
+        'chapter05.list_class': (lambda i: ('GET', f'/chapter05/list_class?page={i}', None, b''), 1),
+        'chapter05.sub_query': (lambda i: ('GET', f'/chapter05/query?query_string=q{i}', None, b''), 1),
+        'chapter05.verify_query': (lambda i: ('GET', '/chapter05/verify_query', [('x-token', 't')], b''), 1),
+        # bcrypt 每次约几百毫秒，请求数少一些
+        'chapter06.jwt_token': (lambda i: ('POST', '/chapter06/jwt/token', login_headers, login_body), 0.05),
+        'chapter06.jwt_me': (lambda i: ('GET', '/chapter06/jwt/users/me', auth, b''), 1),
+        'chapter07.read': (chapter07_read, 1),
+        'chapter07.write': (chapter07_write, 1),
+        'chapter07.timeline': (lambda i: ('GET', f'/chapter07/timeline?city=p{i % cities}&points=100', None, b''), 1),
+        'chapter07.latest': (lambda i: ('GET', f'/chapter07/latest?country_code=C{i % 10}', None, b''), 1),
+    }
+
+
+def run_suite(args) -> dict:
+    from run import app
+    from app.database import engine
+
+    # 不打印 SQL，避免日志影响结果
+    engine.echo = False
+
+    async def main():
+        await lifespan(app, 'startup')
+        try:
+            token = await login(app)
+            scenarios = make_scenarios(args.cities, token, args.upload_size)
+            results = {}
+            for name, (make_request, factor) in scenarios.items():
+                if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                    continue
+                requests = max(1, int(args.requests * factor))
+                # 预热
+                await run_load(app, make_request, concurrency=1, requests=max(1, requests // 10))
+                results[name] = [
+                    await run_load(app, make_request, concurrency=concurrency, requests=requests)
+                    for concurrency in args.concurrency
+                ]
+                print(f'{name:<24} ' + ' '.join(
+                    f'c={row["concurrency"]}: {row["rps"]} rps p95 {row["p95_ms"]}ms' for row in results[name]),
+                    file=sys.stderr)
+            return results
+        finally:
+            await lifespan(app, 'shutdown')
+
+    return asyncio.run(main())
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """返回退化的 (场景, 并发, 说明)；吞吐低于基线或 p95 高于基线超过 tolerance，或出现错误"""
+    regressions = []
+    for name, rows in report['results'].items():
+        baseline_rows = {row['concurrency']: row for row in baseline['results'].get(name, [])}
+        for row in rows:
+            if row['errors']:
+                regressions.append((name, row['concurrency'], f'{row["errors"]} errors'))
+            base = baseline_rows.get(row['concurrency'])
+            if base is None:
+                continue
+            if row['rps'] < base['rps'] * (1 - tolerance):
+                regressions.append((name, row['concurrency'], f'rps {base["rps"]} -> {row["rps"]}'))
+            if row['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+                regressions.append((name, row['concurrency'], f'p95 {base["p95_ms"]}ms -> {row["p95_ms"]}ms'))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16])
+    parser.add_argument('--requests', type=int, default=500, help='每个场景、每个并发数的请求数')
+    parser.add_argument('--cities', type=int, default=50)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--upload-size', type=int, default=64 * 1024)
+    parser.add_argument('--profile', default='prod', help='数据库引擎配置，见 app.database.PROFILES')
+    parser.add_argument('--only', nargs='+', help='只运行名称以这些前缀开头的场景，如 chapter07')
+    parser.add_argument('--json', help='结果写入文件')
+    parser.add_argument('--baseline', help='和基线比较')
+    parser.add_argument('--save-baseline', help='结果保存为基线')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的退化比例')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.sqlite')
+        seed_database(path, cities=args.cities, days=args.days)
+        # 应用在导入时读取配置
+        os.environ['APP_DATABASE_URL'] = f'sqlite:///{path}'
+        os.environ['APP_DB_PROFILE'] = args.profile
+        report = {
+            'meta': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'profile': args.profile,
+                'async_db': os.environ.get('APP_ASYNC_DB', '0'),
+                'cities': args.cities,
+                'days': args.days,
+            },
+            'results': run_suite(args),
+        }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    for path in filter(None, (args.json, args.save_baseline)):
+        with open(path, 'w') as f:
+            f.write(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for name, concurrency, message in regressions:
+            print(f'REGRESSION {name} c={concurrency}: {message}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,6 @@
 import time
 
 from fastapi import FastAPI, Depends, Request
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
 from fastapi.middleware import Middleware
@@ -12,13 +11,21 @@ from fastapi.exceptions import HTTPException, RequestValidationError
 import uvicorn
 
 from tutorial import app03, app04, app05, app06, app07
-from app.main import app07 as app071
+from app import assets, compression, metrics, sqlstats
+from app.config import settings
 
 from tutorial.chapter05 import verify_token
 
 # 全局依赖
 from tutorial.chapter08 import app08
 
+if settings.async_db:
+    # 第七章使用异步数据库访问
+    from app.async_main import app07 as app071
+    from app.async_database import database
+else:
+    from app.main import app07 as app071
+
 app = FastAPI(
     title="FastAPI 接口文档",
     description="description",
@@ -36,6 +43,8 @@ app.add_middleware(
     ],
     allow_methods='*',
     allow_headers="*",
+    # 游标分页的下一页游标
+    expose_headers=['X-Next-Cursor', 'X-DB-Statements', 'X-DB-Time'],
     allow_credentials=True
 )
 
@@ -51,6 +60,22 @@ async def add_process_time_header(request: Request, call_next):
     return response
 
 
+# 每个请求的 SQL 语句数和耗时
+app.add_middleware(sqlstats.SQLStatsMiddleware)
+# 按 Accept-Encoding 压缩响应，流式响应逐块压缩
+app.add_middleware(compression.CompressionMiddleware)
+# 按路由统计请求耗时，最后添加的中间件在最外层，包含其他中间件的耗时
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+@app.get('/metrics', include_in_schema=False)
+async def get_metrics(format: str = None):
+    """Prometheus 文本格式；format=json 时返回每个路由的 p50/p95/p99"""
+    if format == 'json':
+        return metrics.summary()
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
 # 将子应用加到路由
 app.include_router(app03, prefix='/chapter03', tags=['第三章 请求参数和验证'])
 app.include_router(app04, prefix='/chapter04', tags=['第四章 响应处理和FastAPI配置'])
@@ -60,8 +85,13 @@ app.include_router(app071, prefix='/chapter07', tags=['第七章 数据库和模
 app.include_router(app07, prefix='/chapter07', tags=['第七章 数据库和模板'])
 app.include_router(app08, prefix='/chapter08', tags=['第八章 后台任务'])
 
+if settings.async_db:
+    app.add_event_handler('startup', database.connect)
+    app.add_event_handler('shutdown', database.disconnect)
+
 # 需要安装 pip install aiofiles
-app.mount(path='/static', app=StaticFiles(directory='./static'), name='static')
+# 执行 python -m app.assets 构建后，使用加了哈希、预压缩的文件
+app.mount(path='/static', app=assets.AssetFiles(directory='./static'), name='static')
 
 # 重写异常处理器
 # @app.exception_handler(HTTPException)